@@ -1,52 +1,88 @@
 #!/usr/bin/env python
 # encoding: utf-8
 import numpy as np
+from montecarlo import MEMORY, propagate
 
 
 def bolcor(teff):
     """
-    Calculate the bolometric correction, given the temperature
+    Calculate the bolometric correction, given the temperature.
+    Works on scalars and on arrays, where the polynomial is chosen per element.
     """
-    lteff = np.log10(teff)
-    bcflow=np.nan
-
-    if lteff < 3.7:
-        bcflow = -0.190537291496456e+05 + 0.155144866764412e+05 * lteff -\
-            0.421278819301717e+04 * (lteff * lteff) +\
-            0.381476328422343e+03 * (lteff*lteff*lteff)
-    if lteff >= 3.7 and lteff < 3.9:
-        bcflow = -0.370510203809015e+05 + 0.385672629965804e+05 * lteff -\
-            0.150651486316025e+05 * (lteff * lteff) +\
-            0.261724637119416e+04 * (lteff*lteff*lteff) -\
-            0.170623810323864e+03 * (lteff * lteff * lteff * lteff)
-    else:
-        bcflow = -0.118115450538963e+06 + 0.137145973583929e+06 * lteff -\
-            0.636233812100225e+05 * (lteff * lteff) +\
-            0.147412923562646e+05 * (lteff * lteff * lteff) -\
-            0.170587278406872e+04 * (lteff * lteff * lteff * lteff) +\
-            0.788731721804990e+02 * (lteff * lteff * lteff * lteff * lteff)
+    lteff = np.log10(np.asarray(teff, dtype=float))
+    low = -0.190537291496456e+05 + 0.155144866764412e+05 * lteff -\
+        0.421278819301717e+04 * (lteff * lteff) +\
+        0.381476328422343e+03 * (lteff*lteff*lteff)
+    mid = -0.370510203809015e+05 + 0.385672629965804e+05 * lteff -\
+        0.150651486316025e+05 * (lteff * lteff) +\
+        0.261724637119416e+04 * (lteff*lteff*lteff) -\
+        0.170623810323864e+03 * (lteff * lteff * lteff * lteff)
+    high = -0.118115450538963e+06 + 0.137145973583929e+06 * lteff -\
+        0.636233812100225e+05 * (lteff * lteff) +\
+        0.147412923562646e+05 * (lteff * lteff * lteff) -\
+        0.170587278406872e+04 * (lteff * lteff * lteff * lteff) +\
+        0.788731721804990e+02 * (lteff * lteff * lteff * lteff * lteff)
+    bcflow = np.where(lteff < 3.7, low, np.where(lteff < 3.9, mid, high))
+    bcflow = np.where(np.isnan(lteff), np.nan, bcflow)
+    if bcflow.ndim == 0:
+        return float(bcflow)
     return bcflow
 
 
-def parallax(teff,eteff, logg,elogg,vmag,evmag,   mass,emass,  Av,eAv):
+def _asfloat(x):
+    """ Convert values (possibly the string 'NULL') to a float array """
+    x = np.atleast_1d(x)
+    if x.dtype.kind in 'USO':
+        x = np.array([np.nan if str(v).strip() == 'NULL' else float(v)
+                      for v in x.ravel()]).reshape(x.shape)
+    return x.astype(float)
+
+
+def _parallax(teff, logg, vmag, mass, Av):
+    """ Parallax in mas from the spectroscopic parameters """
+    bcflow = bolcor(teff)
+    return 10.**((logg - 4.44 - np.log10(mass) - 4.*np.log10(teff) + \
+        4.*np.log10(5777.) - 0.4*(vmag + bcflow - Av) - 0.11) * 0.5) * 1000
+
+
+def _parallaxTrial(teff, logg, vmag, mass, Av):
+    """ _parallax for a Monte Carlo trial, where the mass can be negative """
+    return _parallax(teff, logg, vmag, abs(mass), Av)
+
+
+def parallax(teff,eteff, logg,elogg,vmag,evmag,   mass,emass,  Av,eAv,
+             ntrials=10000, memory=MEMORY, seed=None, method='mc', rtol=0.01,
+             full_output=False):
     """
     Calculate the parallax, given the mass Santos 2004
+
+    All the parameters can be scalars or arrays, one element per star. Stars
+    with an undefined ('NULL' or NaN) uncertainty get the parallax from the
+    central values and a NaN uncertainty. The Monte Carlo trials are drawn
+    for a chunk of stars at once, with the chunk size set by the memory
+    budget in bytes.
+
+    The uncertainty comes from ntrials Monte Carlo trials (method='mc'),
+    from trials until the relative precision rtol is reached ('adaptive')
+    or from first order propagation ('linear'), see montecarlo.propagate.
+
+    Returns
+    -------
+    par, sig : floats or ndarrays
+        Parallax and associated uncertainty in mas. Floats if all the input
+        parameters are scalars.
+    ntrials : int or ndarray
+        Number of trials used for each star, if full_output.
     """
-    if eteff=='NULL' or elogg=='NULL' or evmag=='NULL' or  emass=='NULL' or  eAv=='NULL':
-        bcflow = bolcor(teff)
-        return 10.**((logg - 4.44 - np.log(mass)/np.log(10.) - 4.*np.log(teff) / np.log(10.) + \
-            4.*np.log(5777.)/np.log(10.) - 0.4*(vmag + bcflow-Av) - 0.11) * 0.5) * 1000, np.nan
-    ntrials = 10000
-    randomteff = float(teff) + float(eteff)*np.random.randn(ntrials)
-    randomlogg = float(logg) + float(elogg)*np.random.randn(ntrials)
-    randommass = abs(mass + emass*np.random.randn(ntrials))
-    randomvmag = float(vmag) + float(evmag)*np.random.randn(ntrials)
-    randomAv = Av + eAv*np.random.randn(ntrials)
-    par=[]
-    for i in range(ntrials):
-        bcflow = bolcor(randomteff[i])
-        par.append(10.**((randomlogg[i] - 4.44 - np.log(randommass[i])/np.log(10.) \
-        - 4.*np.log(randomteff[i]) / np.log(10.) + 4.*np.log(5777.)/np.log(10.) - 0.4*\
-        (randomvmag[i] + bcflow-randomAv[i]) - 0.11) * 0.5) * 1000)
-    sig=np.sqrt(np.sum((par - np.mean(par))**2) / (ntrials - 1))
-    return np.mean(par),sig
+    scalar = all(np.ndim(x) == 0 for x in (teff, eteff, logg, elogg, vmag,
+                                           evmag, mass, emass, Av, eAv))
+    par, sig, n = propagate(_parallaxTrial,
+                            [_asfloat(x) for x in (teff, logg, vmag, mass, Av)],
+                            [_asfloat(x) for x in (eteff, elogg, evmag, emass, eAv)],
+                            method=method, ntrials=ntrials, rtol=rtol,
+                            memory=memory, seed=seed)
+    if scalar:
+        par, sig, n = par[0], sig[0], n[0]
+    if full_output:
+        return par, sig, n
+    return par, sig
@@ -20,43 +20,346 @@ try:
     import pandas as pd
 except ImportError:
     raise ImportError('Install pandas: pip install pandas')
-from PyAstronomy import pyasl
 import argparse
+import json
+import os
+import time
+from TorresMass import radTorresBatch
 
 
-def radTorres(teff, erteff, logg, erlogg, feh, erfeh):
-    ntrials = 100
-    randomteff = teff + erteff*np.random.randn(ntrials)
-    randomlogg = logg + erlogg*np.random.randn(ntrials)
-    randomfeh = feh + erfeh*np.random.randn(ntrials)
-    #Parameters for the Torres calibration:
-    b1, b2, b3 = 2.4427, 0.6679, 0.1771
-    b4, b5, b6 = 0.705, -0.21415, 0.02306
-    b7 = 0.04173
-    logR = np.zeros(ntrials)
-    for i in range(ntrials):
-        X = np.log10(randomteff[i]) - 4.1
-        logR[i] = b1 + b2*X + b3*X**2 + b4*X**3 + b5*randomlogg[i]**2 \
-                    + b6*randomlogg[i]**3 + b7*randomfeh[i]
-    meanRadlog = np.mean(logR)
-    sigRadlog = np.sqrt(np.sum((logR-meanRadlog)**2))/(ntrials-1)
-    sigRadlogTot = np.sqrt(0.014**2 + sigRadlog**2)
-    meanRad = 10**meanRadlog
-    sigRad = 10**(meanRadlog + sigRadlogTot) - meanRad
-    return meanRad, sigRad
+# The merged SWEET-Cat and exoplanetEU table, its columns, and how long
+# (in seconds) they are used before downloading the catalogues again
+CACHE = 'sc_exoplanet.pkl'
+SCHEMA = 'sc_exoplanet_columns.json'
+MAXAGE = 86400.
 
 
-def _parser():
-    parser = argparse.ArgumentParser(description='Preprocess the results')
+def radTorres(teff, erteff, logg, erlogg, feh, erfeh, method='adaptive', rtol=0.05,
+              full_output=False):
+    """
+    Radius from the Torres calibration for arrays of stars. The Monte Carlo
+    trials are added until the radius and its error are known to rtol, or
+    use method='linear' for first order propagation. With full_output the
+    number of trials of each star is returned too.
+    """
+    return radTorresBatch(teff, erteff, logg, erlogg, feh, erfeh, method=method,
+                          rtol=rtol, full_output=full_output)
+
+
+def derivedParameters(df):
+    """
+    Add the radius, radius error, luminosity and equilibrium temperature
+    (for zero albedo) to the merged SWEET-Cat and exoplanetEU table.
+    All the rows are computed at once.
+    """
+    radius, radiuserr = radTorres(df.teff.values, df.erteff.values,
+                                  df.logg.values, df.erlogg.values,
+                                  df.metal.values, df.ermetal.values)
+    df['radius'] = radius
+    df['radiuserr'] = radiuserr
+    df['teq0'] = df.teff*((df.radius*700000.)/(2.*df.sma*150000000.))**(0.5)
+    df['lum'] = (df.teff/5777.)**4 * df.mass
+    return df
+
+
+def download():
+    """ Download SWEET-Cat and exoplanetEU, with a normalized stellar name in each """
+    from PyAstronomy import pyasl
+    # Prepare the SWEET-Cat data
+    print('Downloading the data from SWEET-Cat...')
     sc = pyasl.SWEETCat()
+    sc.downloadData()
     sc = sc.data
+    #Put name lower and remove all spaces, newline or tab characters
+    sc['nameNew'] = sc.star.str.lower().str.replace(' ', '').str.strip()
+    #Prepare the exoplanetEU data
+    print('Downloading the data from exoplanetEU...')
     eu = pyasl.ExoplanetEU()
     eu = eu.getAllData()
+    #Convert the structure to a DataFrame
     eu = pd.DataFrame(eu)
-    p = list(sc.columns) + list(eu.columns) + ['teq0', 'mass', 'masserr', 'radius', 'radiuserr', 'lum']
-    parser.add_argument('x', choices=p)
-    parser.add_argument('y', choices=p)
+    #Put name lower and remove all spaces, newline or tab characters
+    eu['stNameNew'] = eu.stName.str.lower().str.replace(' ', '').str.strip()
+    return sc, eu
+
+
+def _rowHashes(df):
+    """ A hash of the content of each row """
+    return pd.util.hash_pandas_object(df, index=False).values
+
+
+def merge(sc, eu, cache=None):
+    """
+    Merge SWEET-Cat and exoplanetEU based on the stellar name and add the
+    derived parameters. The rows of the merged table record the hash of the
+    input rows they came from (_sc_hash and _eu_hash).
+
+    Parameters
+    ----------
+    sc, eu : DataFrame
+        The catalogues, see download.
+    cache : dict
+        The result of a previous merge. Only the hosts with input rows that
+        were added, removed or changed since then are merged again.
+
+    Returns
+    -------
+    cache : dict
+        The merged table (merged) and the hosts of the input rows, indexed
+        by their hashes (sc and eu).
+    """
+    sc = sc.assign(_sc_hash=_rowHashes(sc))
+    eu = eu.assign(_eu_hash=_rowHashes(eu))
+    new = {'sc': pd.Series(sc.nameNew.values, index=sc._sc_hash.values),
+           'eu': pd.Series(eu.stNameNew.values, index=eu._eu_hash.values)}
+    if cache is None:
+        keep = None
+    else:
+        #The hosts with input rows added or removed (a change is both)
+        hosts = set()
+        for key in ('sc', 'eu'):
+            hosts.update(new[key][~new[key].index.isin(cache[key].index)].values)
+            hosts.update(cache[key][~cache[key].index.isin(new[key].index)].values)
+        keep = cache['merged'][~cache['merged'].nameNew.isin(hosts)]
+        sc = sc[sc.nameNew.isin(hosts)]
+        eu = eu[eu.stNameNew.isin(hosts)]
+        print('Merging %d changed hosts' % len(hosts))
+    df = pd.merge(left=sc, right=eu, left_on='nameNew', right_on='stNameNew')
+    df.rename(columns={'ra_x': 'ra', 'dec_x': 'dec'}, inplace=True)
+    #Calculate radius, luminosity and equilibrium temperature
+    df = derivedParameters(df.reset_index(drop=True))
+    if keep is not None:
+        df = pd.concat([keep, df], ignore_index=True)
+    new['merged'] = df
+    return new
+
+
+def _fresh(fname, maxage):
+    """ True if the file exists and is younger than maxage seconds """
+    return os.path.isfile(fname) and time.time() - os.path.getmtime(fname) < maxage
+
+
+def loadMerged(maxage=MAXAGE, refresh=False):
+    """
+    The merged table, from the local cache if it is younger than maxage
+    seconds. Otherwise the catalogues are downloaded, the hosts that changed
+    are merged again and the cache and the list of columns are saved.
+    """
+    cache = pd.read_pickle(CACHE) if os.path.isfile(CACHE) else None
+    if not isinstance(cache, dict):
+        #Written by an older version, without the input rows
+        cache = None
+    if not refresh and cache is not None and _fresh(CACHE, maxage):
+        return cache['merged']
+    cache = merge(*download(), cache=cache)
+    pd.to_pickle(cache, CACHE)
+    with open(SCHEMA, 'w') as f:
+        json.dump([c for c in cache['merged'].columns if not c.startswith('_')], f)
+    return cache['merged']
+
+
+def columns(maxage=MAXAGE):
+    """ The columns of the merged table, without downloading it if it is cached """
+    if not _fresh(SCHEMA, maxage):
+        loadMerged(maxage, refresh=True)
+    with open(SCHEMA) as f:
+        return json.load(f)
+
+
+LABELS = {'teff': r'$T_\mathrm{eff}$ [K]',
+          'tefferr': r'$\sigma T_\mathrm{eff}$ [K]',
+          'stTeff': r'$T_\mathrm{eff}$ [K]',
+          'logg': r'$\log(g)$ [cgs]',
+          'logglc': r'$\log(g)$ [cgs]',
+          'loggerr': r'\sigma $\log(g)$ [cgs]',
+          'erlogglc': r'\sigma $\log(g)$ [cgs]',
+          'metal': '[Fe/H]',
+          'ermetal': r'$\sigma$ [Fe/H]',
+          'vt': r'$\xi_\mathrm{micro}$ [km/s]',
+          'vterr': r'$\sigma\xi_\mathrm{micro}$ [km/s]',
+          'lum': r'$L_\odot$',
+          'mass': r'$M_\odot$',
+          'ermass': r'$\sigma M_\odot$',
+          'stMass': r'$M_\odot$',
+          'stRadius': r'$R_\odot$',
+          'sma': 'Semi major axis [AU]',
+          'vmag': 'V magnitude',
+          'ervmag': 'Error on V magnitude',
+          'par': 'Parallax ["]',
+          'erpar': 'Error on parallax ["]',
+          'plMass': r'Planet mass [$M_\mathrm{Jup}$]',
+          'plRadius': r'Planet radius [$R_\mathrm{Jup}$]',
+          'period': 'Period [day]',
+          'eccentricity': 'Eccentricity',
+          'inclination': 'Inclination [degree]',
+          'angDistance': 'Angular distance [arcsec]',
+          'discovered': 'Discovered [year]',
+          'omega': r'$\Omega$ [degree]',
+          'tperi': 'Time of periastron [JD]',
+          'mag_v': 'V mag',
+          'mag_i': 'I mag',
+          'mag_j': 'J mag',
+          'mag_h': 'H mag',
+          'mag_k': 'K mag',
+          'dist': 'Distance [pc]',
+          'mh': 'Metallicity',
+          'stAge': 'Stellar age [Gyr]'}
+
+MODES = ('scatter', 'hexbin', 'hist2d')
+
+
+def _bins(values, n, log):
+    """ n bins covering the finite values, logarithmic if log """
+    values = values[np.isfinite(values) & (values > 0 if log else True)]
+    if log:
+        return np.logspace(np.log10(values.min()), np.log10(values.max()), n+1)
+    return np.linspace(values.min(), values.max(), n+1)
+
+
+def plot(df, x, y, z=None, mode='scatter', lx=False, ly=False, ix=False,
+         iy=False, gridsize=50):
+    """
+    Plot two columns of the merged table in the current figure.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The merged table.
+    x, y : str
+        The columns in the axes.
+    z : str
+        The column in the colour scale (and the size of the points for
+        scatter). For the density modes it is averaged in each bin, otherwise
+        the colour is the number of planets in the bin.
+    mode : str
+        scatter, hexbin or hist2d. The density modes are better for large
+        tables.
+    lx, ly, ix, iy : bool
+        Logarithmic and inverse x and y axes.
+    gridsize : int
+        The number of bins along x for the density modes.
+    """
+    xv = df[x].values.astype(float)
+    yv = df[y].values.astype(float)
+    zv = None if z is None else df[z].values.astype(float)
+    if mode == 'scatter':
+        if z:
+            zv[np.isnan(zv)] = min(zv[~np.isnan(zv)])
+            size = (zv-zv.min())/(zv.max()-zv.min())*100
+            size[np.argmin(size)] = 10  # Be sure to see the "smallest" point
+            plt.scatter(xv, yv, c=zv, s=size, cmap=cm.seismic)
+        else:
+            plt.scatter(xv, yv, c=color[0], s=40)
+    else:
+        good = np.isfinite(xv) & np.isfinite(yv)
+        if lx:
+            good &= xv > 0
+        if ly:
+            good &= yv > 0
+        if zv is not None:
+            good &= np.isfinite(zv)
+            zv = zv[good]
+        xv, yv = xv[good], yv[good]
+        if mode == 'hexbin':
+            plt.hexbin(xv, yv, C=zv, gridsize=gridsize, mincnt=1,
+                       xscale='log' if lx else 'linear',
+                       yscale='log' if ly else 'linear',
+                       bins=None if z else 'log', cmap=cm.viridis)
+        elif mode == 'hist2d':
+            bins = [_bins(xv, gridsize, lx), _bins(yv, gridsize, ly)]
+            counts, bx, by = np.histogram2d(xv, yv, bins=bins)
+            if z:
+                with np.errstate(invalid='ignore'):
+                    counts = np.histogram2d(xv, yv, bins=bins, weights=zv)[0] / counts
+            counts[counts == 0] = np.nan
+            plt.pcolormesh(bx, by, counts.T, cmap=cm.viridis)
+        else:
+            raise ValueError('Unknown plot mode: %s' % mode)
+    plt.xlabel(LABELS.get(x, x))
+    plt.ylabel(LABELS.get(y, y))
+    if z or mode != 'scatter':
+        cbar = plt.colorbar()
+        cbar.set_label(LABELS.get(z, z) if z else 'Number of planets')
+    if lx:
+        plt.xscale('log')
+    if ly:
+        plt.yscale('log')
+    if ix:
+        plt.xlim(plt.xlim()[::-1])
+    if iy:
+        plt.ylim(plt.ylim()[::-1])
+    plt.tight_layout()
+    plt.grid(True)
+
+
+_TABLE = None
+
+
+def _initRender(df):
+    """ Keep the merged table in each worker and draw without a display """
+    global _TABLE
+    _TABLE = df
+    plt.switch_backend('Agg')
+
+
+def render(spec, fname):
+    """ Plot one spec (the arguments of plot) of the worker's table to a file """
+    plt.figure()
+    try:
+        plot(_TABLE, **spec)
+        plt.savefig(fname)
+    finally:
+        plt.close()
+    return fname
+
+
+def renderBatch(df, specs, outdir='.', fmt='png', workers=None):
+    """
+    Render many plots of the same table, headless and in parallel.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The merged table, sent once to each worker.
+    specs : list
+        The plots, each a dict with the arguments of plot and optionally the
+        name of the file (name, without extension).
+    outdir : str
+        The directory for the figures.
+    fmt : str
+        The format of the figures, e.g. png or pdf.
+    workers : int
+        The number of processes (default is the number of CPUs).
+
+    Returns
+    -------
+    fnames : list
+        The files written, in the order of specs.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    jobs = []
+    for spec in specs:
+        spec = dict(spec)
+        name = spec.pop('name', None) or '_'.join(
+            spec.get(k) for k in ('x', 'y', 'z', 'mode') if spec.get(k))
+        jobs.append((spec, os.path.join(outdir, '%s.%s' % (name, fmt))))
+    with ProcessPoolExecutor(workers, initializer=_initRender, initargs=(df,)) as pool:
+        futures = [pool.submit(render, spec, fname) for spec, fname in jobs]
+        return [future.result() for future in futures]
+
+
+def _parser():
+    parser = argparse.ArgumentParser(description='Preprocess the results')
+    p = columns()
+    parser.add_argument('x', choices=p, nargs='?')
+    parser.add_argument('y', choices=p, nargs='?')
     parser.add_argument('-z', help='Color scale', choices=p, default=None)
+    parser.add_argument('-m', '--mode', help='Plot the points or their density', 
+                        choices=MODES, default='scatter')
+    parser.add_argument('-g', '--gridsize', help='Number of bins for the density modes', 
+                        type=int, default=50)
     parser.add_argument('-i', '--input', help='File name of result file', default='results.csv')
     parser.add_argument('-c', '--convergence', help='Only plot converged results', 
                         default=True, action='store_false')
@@ -66,129 +369,38 @@ def _parser():
     parser.add_argument('-ly', help='Logarithmic y axis', default=False, action='store_true')
     parser.add_argument('-o', '--output', help='Save a list of arguments to exoplanets.csv', nargs='+')
     parser.add_argument('-t', '--table', help='Table to intercept. Column name must be "star"')
+    parser.add_argument('-r', '--refresh', help='Download the catalogues even if they are cached', 
+                        default=False, action='store_true')
+    parser.add_argument('-b', '--batch', help='JSON file with a list of plots to save '
+                        '(each with x, y and optionally z, mode, gridsize, lx, ly, ix, iy, name)')
+    parser.add_argument('--outdir', help='Directory for the batch plots', default='plots')
+    parser.add_argument('--format', help='Format of the batch plots', default='png')
+    parser.add_argument('--workers', help='Number of processes for the batch plots', 
+                        type=int, default=None)
     args = parser.parse_args()
+    if not args.batch and (args.x is None or args.y is None):
+        parser.error('x and y are required without --batch')
     return args
 
 
 if __name__ == '__main__':
     args = _parser()
-    # Prepare the SWEET-Cat data
-    print('Downloading the data from SWEET-Cat...')
-    sc = pyasl.SWEETCat()
-    sc.downloadData()
-    sc = sc.data
-    #Put name lower and remove all spaces
-    newname = map(lambda x: x.lower().replace(' ', ''), sc.star)
-    #Remove all newline or tab characters
-    newname = map(str.strip, newname)
-    sc['nameNew'] = newname
-    #Prepare the exoplanetEU data
-    print('Downloading the data from exoplanetEU...')
-    eu = pyasl.ExoplanetEU()
-    eu = eu.getAllData()
-    #Convert the structure to a DataFrame
-    eu = pd.DataFrame(eu)
-    #Put name lower and remove all spaces
-    newstname = map(lambda x: x.lower().replace(' ', ''), eu.stName)
-    #Remove all newline or tab characters
-    newstname = map(str.strip, newstname)
-    eu['stNameNew'] = newstname
-    #Merge the two based on the stellar name
-    print(1)
-    df = pd.merge(left=sc, right=eu, left_on='nameNew', right_on='stNameNew')
-    print(2)
-    df.rename(columns={'ra_x': 'ra', 'dec_x': 'dec'}, inplace=True)
-    #Calculate radius and luminosity
-    rr = ['radius', 'radiuserr', 'teq0']
-    if (args.x in rr) or (args.y in rr) or (args.z in rr):
-        params = zip(df.teff, df.erteff, df.logg, df.erlogg, df.metal, df.ermetal)
-        print(3)
-        r = [radTorres(t, et, l, el, f, ef) for t, et, l, el, f, ef in params]
-        #Insert the radius, and luminosity in the table
-        print(4)
-        df['radius'] = pd.Series(np.asarray(r)[:, 0])
-        df['radiuserr'] = pd.Series(np.asarray(r)[:, 1])
-        #Compute Teq0:
-        df['teq0'] = df.teff*((df.radius*700000.)/(2.*df.sma*150000000.))**(0.5)
-    df['lum'] = (df.teff/5777.)**4 * df.mass
+    df = loadMerged(refresh=args.refresh)
     #Intersect the table df with the list of stars in file aaa.rdb
     if args.table:
         tt = pd.read_csv(args.table)
         df2 = pd.merge(left=tt, right=df, left_on='planet', right_on='plName', how='inner')
         df = df2
-    plt.figure()
-    if args.z:
-        z = df[args.z].values
-        color = df[args.z].values
-        z[np.isnan(z)] = min(z[~np.isnan(z)])
-        size = (z-z.min())/(z.max()-z.min())*100
-        size[np.argmin(size)] = 10  # Be sure to see the "smallest" point
-        plt.scatter(df[args.x], df[args.y], c=color, s=size, cmap=cm.seismic)
+    if args.batch:
+        with open(args.batch) as f:
+            specs = json.load(f)
+        for fname in renderBatch(df, specs, args.outdir, args.format, args.workers):
+            print('Saved %s' % fname)
     else:
-        plt.scatter(df[args.x], df[args.y], c=color[0], s=40)
-    labels = {'teff': r'$T_\mathrm{eff}$ [K]',
-              'tefferr': r'$\sigma T_\mathrm{eff}$ [K]',
-              'stTeff': r'$T_\mathrm{eff}$ [K]',
-              'logg': r'$\log(g)$ [cgs]',
-              'logglc': r'$\log(g)$ [cgs]',
-              'loggerr': r'\sigma $\log(g)$ [cgs]',
-              'erlogglc': r'\sigma $\log(g)$ [cgs]',
-              'metal': '[Fe/H]',
-              'ermetal': r'$\sigma$ [Fe/H]',
-              'vt': r'$\xi_\mathrm{micro}$ [km/s]',
-              'vterr': r'$\sigma\xi_\mathrm{micro}$ [km/s]',
-              'lum': r'$L_\odot$',
-              'mass': r'$M_\odot$',
-              'ermass': r'$\sigma M_\odot$',
-              'stMass': r'$M_\odot$',
-              'stRadius': r'$R_\odot$',
-              'sma': 'Semi major axis [AU]',
-              'vmag': 'V magnitude',
-              'ervmag': 'Error on V magnitude',
-              'par': 'Parallax ["]',
-              'erpar': 'Error on parallax ["]',
-              'plMass': r'Planet mass [$M_\mathrm{Jup}$]',
-              'plRadius': r'Planet radius [$R_\mathrm{Jup}$]',
-              'period': 'Period [day]',
-              'eccentricity': 'Eccentricity',
-              'inclination': 'Inclination [degree]',
-              'angDistance': 'Angular distance [arcsec]',
-              'discovered': 'Discovered [year]',
-              'omega': r'$\Omega$ [degree]',
-              'tperi': 'Time of periastron [JD]',
-              'mag_v': 'V mag',
-              'mag_i': 'I mag',
-              'mag_j': 'J mag',
-              'mag_h': 'H mag',
-              'mag_k': 'K mag',
-              'dist': 'Distance [pc]',
-              'mh': 'Metallicity',
-              'stAge': 'Stellar age [Gyr]'}
-    try:
-        plt.xlabel(labels[args.x])
-    except KeyError:
-        plt.xlabel(args.x)
-    try:
-        plt.ylabel(labels[args.y])
-    except KeyError:
-        plt.ylabel(args.y)
-    if args.z:
-        cbar = plt.colorbar()
-        try:
-            cbar.set_label(labels[args.z])
-        except KeyError:
-            cbar.set_label(args.z)
-    if args.lx:
-        plt.xscale('log')
-    if args.ly:
-        plt.yscale('log')
-    if args.ix:
-        plt.xlim(plt.xlim()[::-1])
-    if args.iy:
-        plt.ylim(plt.ylim()[::-1])
-    plt.tight_layout()
-    plt.grid(True)
-    plt.show()
+        plt.figure()
+        plot(df, args.x, args.y, args.z, mode=args.mode, lx=args.lx, ly=args.ly,
+             ix=args.ix, iy=args.iy, gridsize=args.gridsize)
+        plt.show()
     if args.output:
         try:
             dfout = df[args.output]
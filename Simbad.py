@@ -1,23 +1,53 @@
 #!/usr/bin/env python
 # -*- coding: utf8 -*-
+import argparse
+from io import BytesIO
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+import re
+import uuid
+import numpy as np
+import pandas as pd
+from astropy.io.votable import from_table
+from astropy.table import Table
+from sexagesimal import deg2dec, deg2ra
+
+
+# The synchronous TAP service of Simbad
+SIMBAD_TAP = 'https://simbad.cds.unistra.fr/simbad/sim-tap/sync'
+# The uploaded table with the names or positions
+UPLOAD = 'targets'
+# The columns returned for each star, besides the input name
+COLUMNS = ['main_id', 'radeg', 'decdeg', 'ra', 'dec', 'V', 'Verr', 'p', 'perr',
+           'sptype', 'ids']
+
+SELECT = """SELECT t.name, t.rank, b.main_id, b.ra, b.dec, f.flux AS V,
+       f.flux_err AS Verr, b.plx_value AS p, b.plx_err AS perr,
+       b.sp_type AS sptype, s.ids%s
+FROM TAP_UPLOAD.%s AS t
+%s
+LEFT JOIN flux AS f ON f.oidref = b.oid AND f.filter = 'V'
+LEFT JOIN ids AS s ON s.oidref = b.oid"""
+
 
 def simbad(stars, output):
     """
-    Function to make script for Simbad. Takes a list of stars
-    
+    Function to make script for Simbad. Takes a list of stars. See query
+    to get the values directly with a single request.
+
     Parameterts
     -----------
-    stars: 
+    stars:
         A list of stars
-    
+
     Returns
     -------
-    output: 
+    output:
         An output file called SimbadQuery.txt for Simbad to read
     """
-    with open(output, 'wb') as f:
+    with open(output, 'w') as f:
         f.write('\n'.join(stars))
-    with open('SimbadQuery.txt', 'wb') as result:
+    with open('SimbadQuery.txt', 'w') as result:
         result.write('Simbad script for planet hosts\n')
         ttt = '|%IDLIST(HD|Gl|GJ|BD|HIP|CoroT|WASP|Kepler|KOI|KIC|HAT|NGC|XO'
         ttt += '|Qatar|TrES|OGLE|1)|%COO(A)|%COO(D)|%SP(S)|%FLUXLIST(V;F)|%'
@@ -27,3 +57,178 @@ def simbad(stars, output):
             result.write(line.replace('\r', ''))
             result.write('query id '+star.replace('-', ' ') + '\n')
         result.write('format display\n')
+
+
+def identifiers(name):
+    """
+    The identifiers tried in Simbad for a star name, in order: the name
+    with single spaces, and with the dashes as spaces (as in the old
+    Simbad scripts), e.g. 'BD-10 3166' and 'BD 10 3166'
+    """
+    name = re.sub(r'\s+', ' ', str(name).strip())
+    ids = [name]
+    if '-' in name:
+        ids.append(name.replace('-', ' '))
+    return ids
+
+
+def adql(positions=False, radius=5.):
+    """
+    The ADQL query for the uploaded table of names (columns name, rank, id)
+    or of positions (columns name, rank, ra, dec in degrees), matched within
+    radius arcsec.
+    """
+    if positions:
+        join = ("JOIN basic AS b ON 1 = CONTAINS(POINT('ICRS', b.ra, b.dec), "
+                "CIRCLE('ICRS', t.ra, t.dec, %r))" % (radius/3600.))
+        sep = (",\n       DISTANCE(POINT('ICRS', b.ra, b.dec), "
+               "POINT('ICRS', t.ra, t.dec)) AS sep")
+        return SELECT % (sep, UPLOAD, join)
+    join = 'JOIN ident AS i ON i.id = t.id\nJOIN basic AS b ON b.oid = i.oidref'
+    return SELECT % ('', UPLOAD, join)
+
+
+def _votable(table):
+    """ A DataFrame as a VOTable document (bytes) """
+    f = BytesIO()
+    from_table(Table.from_pandas(table)).to_xml(f)
+    return f.getvalue()
+
+
+def _multipart(fields, files):
+    """ Body and content type of a multipart/form-data POST """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for key, value in fields.items():
+        parts.append(('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+                      % (boundary, key, value)).encode('utf8'))
+    for key, content in files.items():
+        parts.append(('--%s\r\nContent-Disposition: form-data; name="%s"; '
+                      'filename="%s.xml"\r\nContent-Type: application/x-votable+xml\r\n\r\n'
+                      % (boundary, key, key)).encode('utf8') + content + b'\r\n')
+    parts.append(('--%s--\r\n' % boundary).encode('utf8'))
+    return b''.join(parts), 'multipart/form-data; boundary=' + boundary
+
+
+def tap(query, upload, url=SIMBAD_TAP, timeout=60):
+    """
+    Run an ADQL query on a TAP service, with a table uploaded as
+    TAP_UPLOAD.targets
+
+    Parameters
+    ----------
+    query : str
+        The ADQL query.
+    upload : DataFrame
+        The table to upload.
+    url : str
+        The synchronous endpoint of the TAP service.
+    timeout : float
+        Timeout in seconds for the request.
+
+    Returns
+    -------
+    result : DataFrame
+        The rows returned.
+    """
+    fields = {'REQUEST': 'doQuery', 'LANG': 'ADQL', 'FORMAT': 'csv',
+              'QUERY': query, 'UPLOAD': '%s,param:%s' % (UPLOAD, UPLOAD)}
+    body, content_type = _multipart(fields, {UPLOAD: _votable(upload)})
+    try:
+        response = urlopen(Request(url, data=body, headers={'Content-Type': content_type}),
+                           timeout=timeout)
+    except HTTPError as e:
+        raise IOError('TAP query failed (%d): %s' % (e.code, e.read()[:1000].decode('utf8', 'replace')))
+    with response:
+        content = response.read()
+    return pd.read_csv(BytesIO(content), keep_default_na=False, na_values=[''])
+
+
+def _result(names, rows):
+    """ The best row for each input name, in the order of names """
+    rows = rows.sort_values(['name', 'rank'] + (['sep'] if 'sep' in rows else []))
+    rows = rows.drop_duplicates('name').set_index('name')
+    rows = rows.rename(columns={'ra': 'radeg', 'dec': 'decdeg'})
+    rows['ra'] = deg2ra(rows['radeg'].values)
+    rows['dec'] = deg2dec(rows['decdeg'].values)
+    if 'sep' in rows:
+        rows['sep'] *= 3600.
+    columns = COLUMNS + (['sep'] if 'sep' in rows else [])
+    result = rows.reindex(index=pd.Index(names, name='name'), columns=columns)
+    result['ra'] = result['ra'].fillna('NULL')
+    result['dec'] = result['dec'].fillna('NULL')
+    return result
+
+
+def query(names, url=SIMBAD_TAP, timeout=60):
+    """
+    Coordinates, V magnitude, parallax, spectral type and identifiers of
+    many stars from Simbad, with a single request
+
+    Parameters
+    ----------
+    names : list
+        The star names.
+    url : str
+        The Simbad TAP service (or a local stand-in).
+    timeout : float
+        Timeout in seconds for the request.
+
+    Returns
+    -------
+    result : DataFrame
+        A row per name (indexed by the names given), with the columns in
+        COLUMNS: the main identifier in Simbad, RA and DEC in degrees
+        (radeg, decdeg) and in SWEET-Cat format (ra, dec), V, Verr, the
+        parallax p and perr (mas), the spectral type and all the
+        identifiers (ids, separated by '|'). Stars not found are NaN.
+    """
+    names = [str(name) for name in names]
+    upload = pd.DataFrame([(name, rank, id) for name in dict.fromkeys(names)
+                           for rank, id in enumerate(identifiers(name))],
+                          columns=['name', 'rank', 'id'])
+    return _result(names, tap(adql(), upload, url, timeout))
+
+
+def queryRegion(names, ra, dec, radius=5., url=SIMBAD_TAP, timeout=60):
+    """
+    The same as query, for the Simbad object closest to each position,
+    within radius arcsec, with a single request
+
+    Parameters
+    ----------
+    names : list
+        A name for each position, used as index of the result.
+    ra, dec : array_like
+        The positions in degrees.
+    radius : float
+        The search radius in arcsec.
+
+    Returns
+    -------
+    result : DataFrame
+        See query, with the separation from the position (sep, arcsec).
+    """
+    names = [str(name) for name in names]
+    upload = pd.DataFrame({'name': names, 'rank': 0,
+                           'ra': np.asarray(ra, dtype=float),
+                           'dec': np.asarray(dec, dtype=float)})
+    return _result(names, tap(adql(True, radius), upload, url, timeout))
+
+
+def _parse():
+    p = argparse.ArgumentParser(description='Get the Simbad values of many stars with one query')
+    p.add_argument('input', help='File with a star name per line', nargs='?', default='names.txt')
+    p.add_argument('-o', '--output', help='The values found (csv)', default='simbad.csv')
+    p.add_argument('-u', '--url', help='The Simbad TAP service', default=SIMBAD_TAP)
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    args = _parse()
+    with open(args.input) as f:
+        names = [name.strip() for name in f if name.strip()]
+    result = query(names, url=args.url)
+    result.to_csv(args.output)
+    print('%d of %d stars found in Simbad. Saved in %s' % (result.main_id.notnull().sum(),
+                                                         len(result), args.output))
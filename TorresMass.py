@@ -1,10 +1,117 @@
 #!/usr/bin/env python
 # -*- coding: utf8 -*-
 import numpy as np
-from astroquery.vizier import Vizier
+from montecarlo import MEMORY, propagate
 
 
-def massTorres(teff, erteff, logg, erlogg, feh, erfeh):
+def _logMass(teff, logg, feh):
+    """ log10 of the mass from the Torres et al. (2010) calibration """
+    # Parameters for the Torres calibration
+    a1 = 1.5689
+    a2 = 1.3787
+    a3 = 0.4243
+    a4 = 1.139
+    a5 = -0.1425
+    a6 = 0.01969
+    a7 = 0.1010
+    X = np.log10(teff) - 4.1
+    # Products instead of powers, which are several times slower on arrays
+    return a1 + X*(a2 + X*(a3 + a4*X)) + logg*logg*(a5 + a6*logg) + a7*feh
+
+
+def _logRad(teff, logg, feh):
+    """ log10 of the radius from the Torres et al. (2010) calibration """
+    # Parameters for the Torres calibration:
+    b1 = 2.4427
+    b2 = 0.6679
+    b3 = 0.1771
+    b4 = 0.705
+    b5 = -0.21415
+    b6 = 0.02306
+    b7 = 0.04173
+    X = np.log10(teff) - 4.1
+    return b1 + b2 * X + b3 * X * X + b4 * X * X * X + b5 * logg * logg \
+        + b6 * logg * logg * logg + b7 * feh
+
+
+def _santos(mass):
+    """ The Santos+(2013) correction of the Torres masses """
+    return 0.791 * mass**2 - 0.575 * mass + 0.701
+
+
+def _santosMoments(mass, sigma):
+    """ Mean and sigma of _santos of a Gaussian mass with sigma """
+    a, b = 0.791, -0.575
+    mean = _santos(mass) + a*sigma**2
+    var = (2*a*mass + b)**2 * sigma**2 + 2*a**2*sigma**4
+    return mean, np.sqrt(var)
+
+
+def massTorresBatch(teff, erteff, logg, erlogg, feh, erfeh, ntrials=10000,
+                    memory=MEMORY, seed=None, method='mc', rtol=0.01,
+                    full_output=False):
+    """
+    Calculate stellar masses for many stars using the Torres et al. (2010)
+    callibration and the Santos+(2013) correction.
+
+    Parameters
+    ----------
+    teff, erteff : array_like
+        Effective temperatures and associated uncertainties.
+    logg, erlogg : array_like
+        Surface gravities and associated uncertainties.
+    feh, erfeh : array_like
+        Metallicities [Fe/H] and associated uncertainties.
+    ntrials : int
+        Number of Monte Carlo trials per star for the uncertainty calculation.
+    memory : float
+        Memory budget in bytes. The stars are processed in chunks so the
+        temporary Monte Carlo arrays stay inside this budget.
+    seed : int or None
+        Seed for the random number generator. Results are reproducible for
+        a given seed and memory budget.
+    method : str
+        mc (ntrials trials), adaptive (trials until the mass and its total
+        uncertainty, with the scatter of the calibration, are known to rtol)
+        or linear (first order propagation), see montecarlo.propagate.
+    rtol : float
+        Relative precision of the mean and uncertainty for adaptive.
+    full_output : bool
+        Also return the number of trials used for each star.
+
+    Returns
+    -------
+    meanMass, sigMass : ndarrays
+        Estimates for the stellar masses and associated uncertainties.
+    ntrials : ndarray
+        Number of trials used for each star, if full_output.
+    """
+    options = dict(method=method, ntrials=ntrials, rtol=rtol, memory=memory)
+    rng = np.random.RandomState(seed)
+    meanlogMass, siglogMass, n = propagate(
+        _logMass, (teff, logg, feh), (erteff, erlogg, erfeh),
+        seed=rng, scatter=0.027, **options)
+    # Add (quadratically) the intrinsic error of the calibration (0.027 in log mass).
+    siglogMass = np.sqrt(0.027**2 + siglogMass**2)
+    meanMass = 10**meanlogMass
+    sigMass = 10**(meanlogMass + siglogMass) - meanMass
+    # Correct the mass for the offset relative to isochrone-derived masses.
+    # correction comes from Santos+(2013), the SWEET-Cat paper
+    idx = np.where((meanMass >= .7) & (meanMass <= 1.3))[0]
+    if idx.size and method == 'adaptive':
+        # The correction is quadratic, so its mean and sigma for a Gaussian
+        # mass are exact and no trials are needed
+        meanMass[idx], sigMass[idx] = _santosMoments(meanMass[idx], sigMass[idx])
+    elif idx.size:
+        meanMass[idx], sigMass[idx], ncor = propagate(
+            _santos, (meanMass[idx],), (sigMass[idx],), seed=rng, **options)
+        n[idx] += ncor
+    if full_output:
+        return meanMass, sigMass, n
+    return meanMass, sigMass
+
+
+def massTorres(teff, erteff, logg, erlogg, feh, erfeh, method='mc'):
     """ 
     Calculate stellar mass using the Torres et al. (2010) callibration.
     
@@ -16,66 +123,66 @@ def massTorres(teff, erteff, logg, erlogg, feh, erfeh):
         Surface gravity and associated uncertainty.
     feh, erfeh : floats
         Metallicity [Fe/H] and associated uncertainty.
+    method : str
+        mc, adaptive or linear, see massTorresBatch.
    
     Returns
     -------
     meanMass, sigMass : floats
         Estimate for the stellar mass and associated uncertainty.
     """
-    # Number of Monte Carlo trials for the uncertainty calculation.
-    ntrials = 10000
-    randomteff = teff + erteff * np.random.randn(ntrials)
-    randomlogg = logg + erlogg * np.random.randn(ntrials)
-    randomfeh = feh + erfeh * np.random.randn(ntrials)
-    # Parameters for the Torres calibration
-    a1 = 1.5689
-    a2 = 1.3787
-    a3 = 0.4243
-    a4 = 1.139
-    a5 = -0.1425
-    a6 = 0.01969
-    a7 = 0.1010
-    X = np.log10(randomteff) - 4.1
-    logMass = a1 + a2*X + a3*X**2 + a4*X**3 + a5*randomlogg**2 + a6*randomlogg**3 + a7*randomfeh
-    meanlogMass = np.mean(logMass)
-    siglogMass = np.sum((logMass - meanlogMass)**2) / (ntrials - 1)
-    # Add (quadratically) the intrinsic error of the calibration (0.027 in log mass).
-    siglogMass = np.sqrt(0.027**2 + siglogMass)
-    meanMass = 10**meanlogMass
-    sigMass = 10**(meanlogMass + siglogMass) - meanMass
-    # Correct the mass for the offset relative to isochrone-derived masses.
-    if .7<=meanMass<=1.3:
-        # correction comes from Santos+(2013), the SWEET-Cat paper
-        randomMass = meanMass + sigMass * np.random.randn(ntrials)
-        corrected_Mass = 0.791 * randomMass**2 - 0.575 * randomMass + 0.701
-        meanMassCor = np.mean(corrected_Mass)
-        sigMassCor = np.sqrt(np.sum((corrected_Mass - meanMassCor)**2) / (ntrials - 1))
-        return meanMassCor, sigMassCor
-    return meanMass, sigMass
+    meanMass, sigMass = massTorresBatch(teff, erteff, logg, erlogg, feh, erfeh,
+                                        method=method)
+    return meanMass[0], sigMass[0]
 
 
-def radTorres(teff, erteff, logg, erlogg, feh, erfeh):
-    ntrials = 10000
-    randomteff = teff + erteff*np.random.randn(ntrials)
-    randomlogg = logg + erlogg*np.random.randn(ntrials)
-    randomfeh = feh + erfeh*np.random.randn(ntrials)
-    # Parameters for the Torres calibration:
-    b1 = 2.4427
-    b2 = 0.6679
-    b3 = 0.1771
-    b4 = 0.705
-    b5 = -0.21415
-    b6 = 0.02306
-    b7 = 0.04173
-    #R = np.zeros(ntrials)
-    #logR = np.zeros(ntrials)
-    X = np.log10(randomteff) - 4.1
-    logRad = b1 + b2 * X + b3 * X * X + b4 * X * X * X + b5 * randomlogg * randomlogg \
-    + b6 * randomlogg * randomlogg * randomlogg + b7 * randomfeh
-    #R = 10 ** logRad
-    meanRadlog = np.mean(logRad)
-    sigRadlog = np.sqrt(np.sum((logRad-meanRadlog)**2) / (ntrials-1))
+def radTorresBatch(teff, erteff, logg, erlogg, feh, erfeh, ntrials=10000,
+                   memory=MEMORY, seed=None, method='mc', rtol=0.01,
+                   full_output=False):
+    """
+    Calculate stellar radii for many stars using the Torres et al. (2010)
+    callibration.
+
+    Parameters
+    ----------
+    teff, erteff : array_like
+        Effective temperatures and associated uncertainties.
+    logg, erlogg : array_like
+        Surface gravities and associated uncertainties.
+    feh, erfeh : array_like
+        Metallicities [Fe/H] and associated uncertainties.
+    ntrials : int
+        Number of Monte Carlo trials per star for the uncertainty calculation.
+    memory : float
+        Memory budget in bytes for the temporary Monte Carlo arrays.
+    seed : int or None
+        Seed for the random number generator.
+    method : str
+        mc, adaptive or linear, see massTorresBatch.
+    rtol : float
+        Relative precision of the mean and uncertainty for adaptive.
+    full_output : bool
+        Also return the number of trials used for each star.
+
+    Returns
+    -------
+    meanRad, sigRad : ndarrays
+        Estimates for the stellar radii and associated uncertainties.
+    ntrials : ndarray
+        Number of trials used for each star, if full_output.
+    """
+    meanRadlog, sigRadlog, n = propagate(
+        _logRad, (teff, logg, feh), (erteff, erlogg, erfeh), method=method,
+        ntrials=ntrials, rtol=rtol, memory=memory, seed=seed, scatter=0.014)
     sigRadlog = np.sqrt(0.014**2 + sigRadlog**2)
     meanRad = 10**meanRadlog
     sigRad = 10**(meanRadlog + sigRadlog) - meanRad
+    if full_output:
+        return meanRad, sigRad, n
     return meanRad, sigRad
+
+
+def radTorres(teff, erteff, logg, erlogg, feh, erfeh, method='mc'):
+    meanRad, sigRad = radTorresBatch(teff, erteff, logg, erlogg, feh, erfeh,
+                                     method=method)
+    return meanRad[0], sigRad[0]
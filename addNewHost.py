@@ -1,47 +1,114 @@
 #!/usr/bin/env python
 # -*- coding: utf8 -*-
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import os
+import threading
 import numpy as np
 from astropy import coordinates as coord
 from astropy import units as u
+from astropy.utils import minversion
 import pandas as pd
 from clint.textui import puts, colored
 import time
 from ParallaxSpec import parallax
+from catalogue import NAMES, appendRDB, formatValue
+from exotable import readTable
+from extinction import ExtinctionGrid, irsaQuery
+from gaialocal import GaiaLocal, gaiaMatch
+from querycache import QueryCache
+from sexagesimal import deg2dec, deg2ra, dec2deg, ra2deg
+from runlog import RunLog, profile
 from astroquery.simbad import Simbad
 import warnings
 warnings.filterwarnings('ignore')
-from astroquery.irsa_dust import IrsaDust
 from astroquery.vizier import Vizier
+from astroquery.exceptions import RemoteServiceError, TableParseError
+from astroquery.exceptions import TimeoutError as AstroqueryTimeout
 
 
-def GAIAplx(ra,de):
-    v = Vizier(columns=["*", "+_r"], catalog='I/345/gaia2')
-    pos = coord.SkyCoord(ra=ra, dec=de, unit=(u.hourangle,u.deg), frame='icrs', 
+# Gaia DR2 in Vizier, and the local copy of a subset of it (see gaialocal.py)
+GAIA_CATALOG = 'I/345/gaia2'
+GAIA_LOCAL = 'gaia_local'
+# The local extinction grid (see extinction.py)
+EXTINCTION_GRID = 'extinction.npz'
+# The object types in Simbad of the planets and brown dwarfs around a host
+# (the short names since astroquery 0.4.8)
+NOT_STARS = ['Planet', 'Planet?', 'brownD*', 'Pl', 'Pl?', 'BD*']
+# The errors of a remote query that failed (requests and connection errors
+# are OSErrors)
+QUERY_ERRORS = (OSError, AstroqueryTimeout, RemoteServiceError, TableParseError)
+# The errors of a result that cannot be read, or of a star not found
+PARSE_ERRORS = (KeyError, IndexError, ValueError)
+
+
+def _vizierPlx(ra, de, radius):
+    """ Gaia DR2 parallaxes from Vizier, with one multi-position query """
+    pos = coord.SkyCoord(ra=ra, dec=de, unit=(u.deg,u.deg), frame='icrs',
                          obstime='J2000')
-    result = v.query_region(pos, radius="10s", catalog='I/345/gaia2')
-    #Moving the positions to 2000
+    v = Vizier(columns=["*", "+_r"], catalog=GAIA_CATALOG, row_limit=-1)
+    result = v.query_region(pos, radius=radius, catalog=GAIA_CATALOG)
+    table = result[0] if len(result) else None
+    return gaiaMatch(pos.ra.deg, pos.dec.deg, table)
+
+
+def GAIAplxBatch(ra, de, radius='10s'):
+    """
+    Gaia DR2 parallaxes of many hosts with one multi-position query. If the
+    local catalogue in GAIA_LOCAL exists it is used first, and only the
+    hosts without a match in it are queried in Vizier.
+
+    Parameters
+    ----------
+    ra, de : list
+        RA and DEC of the hosts in SWEET-Cat format (J2000).
+    radius : str
+        Search radius around each host.
+
+    Returns
+    -------
+    plx : DataFrame
+        plx, e_plx, sep (arcsec) and source id of each host, see gaiaMatch.
+    """
+    ra, de = np.asarray(ra2deg(list(ra))), np.asarray(dec2deg(list(de)))
+    if not os.path.isdir(GAIA_LOCAL):
+        return _vizierPlx(ra, de, radius)
+    plx = GaiaLocal(GAIA_LOCAL).match(ra, de, radius=coord.Angle(radius).arcsec)
+    # The local catalogue is a subset of Gaia
+    missing = np.where(np.isnan(plx.plx.values))[0]
+    if len(missing):
+        found = _vizierPlx(ra[missing], de[missing], radius)
+        found.index = plx.index[missing]
+        plx.loc[found.index] = found
+    return plx
+
+
+def gaiaQuery(ra, de):
+    """
+    Gaia DR2 parallax and error of a host at RA and DEC in SWEET-Cat
+    format, NULL if there is no Gaia source. A query that fails raises one
+    of QUERY_ERRORS, so it is not cached as a host without a parallax.
+    """
+    plx = GAIAplxBatch([ra], [de]).iloc[0]
+    if np.isnan(plx.plx):
+        return 'NULL','NULL'
+    return str(round(plx.plx,2)), str(round(plx.e_plx,2))
+
+
+def GAIAplx(ra,de):
+    """ The same as gaiaQuery, with NULL if the query fails """
     try:
-        deltat = -15.5
-        sep = []
-        for ig, _ in enumerate(result[0]['Source']):
-            raold=result[0]['RA_ICRS'].data[ig]+(result[0]['pmRA'].data[ig]*deltat)/3600000.
-            deold=result[0]['DE_ICRS'].data[ig]+(result[0]['pmDE'].data[ig]*deltat)/3600000.
-            posold = coord.ICRS(ra=raold * u.deg, dec=deold * u.deg)
-            sep.append(pos.separation(posold).arcsecond)
-        indG = np.argmin(sep)
-        if sep[indG]<1.5 and result[0]['Plx'].data[indG]>0:
-            return str(round(result[0]['Plx'].data[indG],2)), \
-                    str(round(result[0]['e_Plx'].data[indG],2))
-    except:
+        return gaiaQuery(ra, de)
+    except (IndexError,) + QUERY_ERRORS:
         return 'NULL','NULL'
-    return 'NULL','NULL'
 
 
 def torres(name, teff=False, logg=False, feh=False):
     """
     Calculates the mass and error from Torres. See source for more information
     """
-    from TorresMass import massTorres
+    from TorresMass import massTorresBatch
     T, Terr = teff
     L, Lerr = logg
     F, Ferr = feh
@@ -51,9 +118,10 @@ def torres(name, teff=False, logg=False, feh=False):
     except ValueError:
         puts(colored.red('No mass derived for this star...'))
         return 'NULL', 'NULL'
-    M, Merr = massTorres(T, Terr, L, Lerr, F, Ferr)
-    puts(colored.green('Done'))
-    return round(M, 2), round(Merr, 2)
+    M, Merr, n = massTorresBatch(T, Terr, L, Lerr, F, Ferr, method='adaptive',
+                                 full_output=True)
+    puts(colored.green('Done') + ' (%d trials)' % n[0])
+    return round(M[0], 2), round(Merr[0], 2)
 
 
 def variable_assignment(digits):
@@ -64,21 +132,268 @@ def variable_assignment(digits):
     return x
 
 
-if __name__ == '__main__':
-    with open('names.txt') as f:
-        stars = f.readlines()
-    f.close()
-    var = 'Y'
-    #Read the data from exoplanet.eu
-    fields = ['star_name', 'ra', 'dec', 'mag_v', 'star_metallicity', 
-              'star_metallicity_error_min','star_metallicity_error_max',
-              'star_teff','star_teff_error_min','star_teff_error_max']
-    exo_all = pd.read_csv('exo.csv', skipinitialspace=True, usecols=fields)
-    #Remove trailing whitespaces
-    exo_all.star_name = exo_all.star_name.str.strip()
-    output = 'WEBSITE_online_ADD.rdb'
+def coordinates(ra, dec):
+    """ RA and DEC in degrees to the strings used in SWEET-Cat """
+    return str(deg2ra(ra)[0]), str(deg2dec(dec)[0])
+
+
+def simbadQuery(ra, dec):
+    """ Search in Simbad the parallax, Vmag and spectral type around a position in degrees """
+    customSimbad = Simbad()
+    if minversion('astroquery', '0.4.8'):
+        # The fields were renamed, and the flux errors removed
+        customSimbad.add_votable_fields('plx_value', 'plx_err', 'V', 'sp_type',
+                                        'otype', 'ids')
+    else:
+        customSimbad.add_votable_fields('plx', 'plx_error', 'flux(V)', 
+                                        'flux_error(V)', 'sptype', 
+                                        'otype', 'ids')
+    return customSimbad.query_region(coord.SkyCoord(ra=ra, dec=dec,
+                                                    unit=(u.deg, u.deg),
+                                                    frame='icrs'), radius='15s')
+
+
+@lru_cache(maxsize=None)
+def extinctionGrid():
+    """ The local extinction grid, loaded once """
+    return ExtinctionGrid(EXTINCTION_GRID)
+
+
+def dustQuery(ra, dec, live=True):
+    """
+    Extinction (mean and std) at RA and DEC in SWEET-Cat format, from the
+    local grid (see extinction.py). If its cell is not filled yet, it is
+    filled from IRSA, unless live is False.
+
+    The value is the one of the nearest cell centre, not interpolated: with
+    the 1 degree grid the centre is at most ~0.7 degrees away, well inside
+    the 2 degree radius of the IRSA query that gave the value of the cell.
+    """
+    radeg, decdeg = ra2deg(ra), dec2deg(dec)
+    grid = extinctionGrid()
+    Av, Averr = grid.lookup(radeg, decdeg)
+    if np.isnan(Av[0]) and live:
+        grid.fill(radeg, decdeg, irsaQuery)
+        grid.save()
+        Av, Averr = grid.lookup(radeg, decdeg)
+    if np.isnan(Av[0]):
+        raise ValueError('No extinction at %s %s' % (ra, dec))
+    return Av[0], Averr[0]
+
+
+class RateLimiter:
+    """ Limit the calls to a service to a rate (calls per second) shared by all threads """
+    def __init__(self, rate=None):
+        self.interval = 1./rate if rate else 0.
+        self.lock = threading.Lock()
+        self.next = 0.
+
+
+    def wait(self):
+        """ Block until the next call is allowed """
+        with self.lock:
+            now = time.time()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+# The remote services, and their rate limits (calls per second), used in
+# batch mode. Any of them can be replaced, e.g. with local stand-ins.
+SERVICES = {'simbad': simbadQuery, 'gaia': gaiaQuery, 'dust': dustQuery}
+RATES = {'simbad': 5., 'gaia': 5., 'dust': 2.}
+# The fields that need a human if they are not found in batch mode
+REVIEW = ['hd', 'V', 'Verr', 'p', 'perr', 'Teff', 'Tefferr', 'logg', 'logger',
+          'vt', 'vterr', 'feh', 'feherr', 'M', 'Merr', 'author', 'link']
+
+
+def meanError(errmin, errmax):
+    """ Mean of the lower and upper errors, or the one that is defined """
+    errors = [e for e in (errmin, errmax) if ~np.isnan(e)]
+    if errors:
+        return sum(errors)/len(errors)
+    return np.nan
+
+
+def _simbadColumn(result, *names):
+    """
+    The first column of a Simbad result with one of the names, in any case
+    (astroquery 0.4.8 changed the names and their case), or None
+    """
+    columns = dict((column.casefold(), column) for column in result.colnames)
+    for name in names:
+        if name.casefold() in columns:
+            return result[columns[name.casefold()]]
+    return None
+
+
+def simbadValues(result):
+    """
+    The values for SWEET-Cat from a Simbad query around a star
+
+    Returns
+    -------
+    values : dict
+        HD, RA, DEC, V, Verr, p, perr and sptype, for the values found.
+    """
+    if result is None or len(result) == 0:
+        return {}
+    column = lambda *names: _simbadColumn(result, *names)
+    if column('RA') is None or column('DEC') is None:
+        raise KeyError('No RA and DEC in the Simbad result')
+    #select the star and not the planet, they have the same coordinates
+    otype = column('OTYPE')
+    star = [] if otype is None else np.where(~np.isin(np.asarray(otype, dtype=str), NOT_STARS))[0]
+    indr = star[0] if len(star) else 0
+    ra, dec = column('RA')[indr], column('DEC')[indr]
+    if isinstance(ra, str):
+        values = {'RA': ra[:11], 'DEC': str(dec)[:12]}
+    else:
+        #in degrees since astroquery 0.4.8
+        values = dict(zip(['RA', 'DEC'], coordinates(ra, dec)))
+    ids = column('IDS')
+    if ids is not None:
+        for iname in str(ids[indr]).split('|'):
+            if iname[:2] == 'HD':
+                values['HD'] = iname.replace('HD ', '')
+    for key, names in [('V', ('FLUX_V', 'V')), ('Verr', ('FLUX_ERROR_V',)),
+                       ('p', ('PLX_VALUE',)), ('perr', ('PLX_ERROR', 'PLX_ERR'))]:
+        found = column(*names)
+        if found is not None and not np.ma.is_masked(found[indr]) \
+           and np.isfinite(float(found[indr])):
+            values[key] = round(float(found[indr]), 2)
+    sptype = column('SP_TYPE')
+    if sptype is not None and not np.ma.is_masked(sptype[indr]) and sptype[indr] != '':
+        values['sptype'] = sptype[indr]
+    return values
+
+
+def lookup(ra, dec, services=SERVICES, limits=None):
+    """
+    All the remote lookups (Simbad, Gaia and dust) for a star at RA and DEC
+    in degrees. A lookup that fails (QUERY_ERRORS) or with a result that
+    cannot be read (PARSE_ERRORS) is treated as nothing found. Other errors
+    are bugs, and are raised.
+    """
+    limits = limits or {}
+    def call(service, *args, parse=lambda result: result):
+        if service in limits:
+            limits[service].wait()
+        try:
+            #a result that cannot be read is a failed lookup too
+            return parse(services[service](*args))
+        except QUERY_ERRORS + PARSE_ERRORS:
+            return None
+    RA, DEC = coordinates(ra, dec)
+    values = {'RA': RA, 'DEC': DEC}
+    values.update(call('simbad', ra, dec, parse=simbadValues) or {})
+    plx = call('gaia', values['RA'], values['DEC'])
+    if plx is not None and plx[0] != 'NULL':
+        values['p'], values['perr'], values['pflag'] = plx[0], plx[1], 'GAIADR2'
+    elif 'p' in values:
+        values['pflag'] = 'Simbad'
+    else:
+        values.pop('perr', None)
+        #the spectroscopic parallax needs logg, so only the extinction is saved
+        Av = call('dust', values['RA'], values['DEC'])
+        if Av is not None:
+            values['Av'], values['Averr'] = Av
+    return values
+
+
+def batch(stars, exo_all, output, review='review.csv', workers=8,
+          services=None, rates=None, log=None):
+    """
+    Add all the stars without asking. The remote lookups run concurrently
+    and all the values that can be found automatically are written to the
+    output. The fields that still need a human are listed in the review file.
+
+    Parameters
+    ----------
+    stars : list
+        Names of the new hosts.
+    exo_all : DataFrame
+        The table from exoplanet.eu.
+    output : str
+        The rdb file to add the stars to.
+    review : str
+        The csv file with the missing fields of each star.
+    workers : int
+        Maximum number of concurrent lookups.
+    services : dict
+        Replacements for the functions in SERVICES.
+    rates : dict
+        Replacements for the rate limits in RATES.
+    log : RunLog
+        Records the time of the lookups of each star and of each remote call.
+
+    Returns
+    -------
+    missing : DataFrame
+        The content of the review file.
+    """
+    services = dict(SERVICES, **(services or {}))
+    log = RunLog() if log is None else log
+    services = dict((service, log.timed(service, func)) for service, func in services.items())
+    rates = dict(RATES, **(rates or {}))
+    limits = dict((service, RateLimiter(rate)) for service, rate in rates.items())
+    stars = [star.strip() for star in stars if star.strip()]
+    exo_all = exo_all.drop_duplicates('star_name').set_index('star_name')
+    notfound = [star for star in stars if star not in exo_all.index]
+    if notfound:
+        puts(colored.red(str(len(notfound))) + ' stars not found. Added in the file manual.list.')
+        with open('manual.list', 'a') as manual:
+            manual.write(''.join(star + '\n' for star in notfound))
+    stars = [star for star in stars if star in exo_all.index]
+    exo = exo_all.loc[stars]
+    def find(star, ra, dec):
+        with log.stage('star', star=star):
+            return lookup(ra, dec, services, limits)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        found = list(pool.map(find, stars, exo.ra.values, exo.dec.values))
+    update = str(time.strftime("%Y-%m-%d"))
+    rows, missing = [], []
+    for star, (_, e), values in zip(stars, exo.iterrows(), found):
+        Ferr = meanError(e.star_metallicity_error_min, e.star_metallicity_error_max)
+        Tefferr = meanError(e.star_teff_error_min, e.star_teff_error_max)
+        sptype = values.get('sptype', '')
+        row = {'name': star, 'hd': values.get('HD'),
+               'ra': values['RA'], 'dec': values['DEC'],
+               'V': values.get('V', e.mag_v), 'Verr': values.get('Verr'),
+               'p': values.get('p'), 'perr': values.get('perr'),
+               'pflag': values.get('pflag'),
+               'Teff': None if np.isnan(e.star_teff) else int(e.star_teff),
+               'Tefferr': None if np.isnan(Tefferr) else int(Tefferr),
+               'feh': None if np.isnan(e.star_metallicity) else round(float(e.star_metallicity), 2),
+               'feherr': None if np.isnan(Ferr) else round(Ferr, 2),
+               'source': '0', 'update': update,
+               'comment': sptype if sptype[:1] == 'M' else None}
+        rows.append([row.get(column) for column in NAMES])
+        missing.append({'star': star,
+                        'missing': ' '.join(column for column in REVIEW
+                                            if formatValue(row.get(column)) == 'NULL'),
+                        'Av': values.get('Av', np.nan),
+                        'Averr': values.get('Averr', np.nan)})
+    appendRDB(output, rows)
+    missing = pd.DataFrame(missing, columns=['star', 'missing', 'Av', 'Averr'])
+    missing.to_csv(review, index=False)
+    #All the new hosts are done
+    with open('names.txt', 'w') as names:
+        names.write('')
+    puts(colored.green(str(len(rows))) + ' stars added to ' + output + 
+         '. Check ' + review + ' for the missing fields.')
+    return missing
+
+
+def interactive(stars, exo_all, output, log):
+    """
+    Ask for the parameters of each star not found automatically and add it
+    to the output. names.txt is updated after each star.
+    """
     for i, star in enumerate(stars):
         star = star.strip('\n')
+        started = time.time()
         exo = exo_all[exo_all.star_name == star]
         next = True
         print('')
@@ -110,31 +425,9 @@ if __name__ == '__main__':
             if var.upper().strip()=='Y':
                 #Get RA and dec
                 ra, dec = float(exo.ra.values[0]), float(exo.dec.values[0])
-                c = coord.SkyCoord(ra, dec, unit=(u.degree, u.degree), frame='icrs')
-                RA = list(c.ra.hms)
-                RA[0] = str(int(RA[0])).zfill(2)
-                RA[1] = str(int(RA[1])).zfill(2)
-                RA[2] = str(round(RA[2], 2)).zfill(4)
-                if len(RA[2]) == 4:
-                    RA[2] += '0'
-                RA = "{0} {1} {2}".format(*RA)
-                DEC = list(c.dec.dms)
-                DEC[0] = str(int(DEC[0])).zfill(2)
-                DEC[1] = str(abs(int(DEC[1]))).zfill(2)
-                DEC[2] = str(abs(round(DEC[2], 2))).zfill(4)
-                if int(DEC[0]) > 0:
-                    DEC[0] = '+'+DEC[0]
-                if len(DEC[2]) == 4:
-                    DEC[2] += '0'
-                DEC = "{0} {1} {2}".format(*DEC)
+                RA, DEC = coordinates(ra, dec)
                 #search in Simbad the parallax, Vmag and spectral type
-                customSimbad = Simbad()
-                customSimbad.add_votable_fields('plx', 'plx_error', 'flux(V)', 
-                                                'flux_error(V)', 'sptype', 
-                                                'otype', 'ids')
-                result = customSimbad.query_region(coord.SkyCoord(ra = c.ra, 
-                                                                  dec = c.dec,
-                                                                  frame = 'icrs'),radius='15s')
+                result = simbadQuery(ra, dec)
                 empty = 'NULL'
                 #Here comes the user interface part...
                 puts(colored.black('\nStandard parameters\n'))
@@ -269,16 +562,9 @@ if __name__ == '__main__':
                         pflag = 'Simbad'
                     else:
                         try:
-                            pos = coord.SkyCoord(ra=ra, dec=dec, 
-                                                 unit=(u.hourangle,u.deg), 
-                                                 frame='icrs')
-                            #AvSF = Schlafly & Finkbeiner 2011 (ApJ 737, 103)
-                            tableAv = IrsaDust.get_query_table(pos, radius='02d',
-                                                               section='ebv',
-                                                               timeout=60)
-                            Av = tableAv['ext SandF mean'].data[0]
-                            Averr = tableAv['ext SandF std'].data[0]
-                        except:
+                            Av, Averr = dustQuery(RA, DEC)
+                        except Exception as e:
+                            puts(colored.yellow('No extinction found, using Av=0: ') + str(e))
                             Av = 0
                             Averr = 0
                         try:    
@@ -323,16 +609,9 @@ if __name__ == '__main__':
                         pflag = 'GAIADR2' 
                     else:
                         try:
-                            pos=coord.SkyCoord(ra=RA, dec=DEC, 
-                                               unit=(u.hourangle,u.deg), 
-                                               frame='icrs')
-                            #AvSF = Schlafly & Finkbeiner 2011 (ApJ 737, 103)
-                            tableAv = IrsaDust.get_query_table(pos, radius='02d',
-                                                               section='ebv',
-                                                               timeout=60)
-                            Av=tableAv['ext SandF mean'].data[0]
-                            Averr=tableAv['ext SandF std'].data[0]
-                        except:
+                            Av, Averr = dustQuery(RA, DEC)
+                        except Exception as e:
+                            puts(colored.yellow('No extinction found, using Av=0: ') + str(e))
                             Av=0
                             Averr=0
                         try:
@@ -357,11 +636,9 @@ if __name__ == '__main__':
                           Tefferr,logg, loggerr, 'NULL', 'NULL', vt, vterr, 
                           FeH, Ferr, M, Merr, author, link, source, update, 
                           comment]
-                params = map(str, params)
                 #New host information
-                with open(output, 'a') as f:
-                    f.write('\n'+'\t'.join(params) + '\tNULL')
-                f.close()
+                appendRDB(output, [params + ['NULL']])
+                log.add('star', time.time() - started, star=star)
                 #Update the list of new hosts
                 with open('names.txt', 'w') as names:
                     #if the last star was added so no star is updated
@@ -376,3 +653,60 @@ if __name__ == '__main__':
             else:
                 print('Bye then (¬_¬)')
                 break
+
+
+def _parse():
+    """ Add new hosts to SWEET-Cat """
+    p = argparse.ArgumentParser(description='Add the new hosts in names.txt to SWEET-Cat')
+    p.add_argument('-b', '--batch', help='Add all the stars without asking', 
+                   default=False, action='store_true')
+    p.add_argument('-w', '--workers', help='Concurrent lookups in batch mode', 
+                   type=int, default=8)
+    p.add_argument('-r', '--review', help='File with the fields to review in batch mode', 
+                   default='review.csv')
+    p.add_argument('-c', '--cache', help='File with the cached Simbad and Gaia queries', 
+                   default='querycache.sqlite')
+    p.add_argument('-l', '--log', help='Save the time of each star and remote call to a JSON (or .csv) file')
+    p.add_argument('-p', '--profile', help='Save cProfile stats of the run to a file')
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    args = _parse()
+    with open('names.txt') as f:
+        stars = f.readlines()
+    f.close()
+    var = 'Y'
+    #Read the data from exoplanet.eu
+    fields = ['star_name', 'ra', 'dec', 'mag_v', 'star_metallicity', 
+              'star_metallicity_error_min','star_metallicity_error_max',
+              'star_teff','star_teff_error_min','star_teff_error_max']
+    exo_all = readTable('exo.csv', columns=fields)
+    #Remove trailing whitespaces
+    exo_all.star_name = exo_all.star_name.str.strip()
+    output = 'WEBSITE_online_ADD.rdb'
+    #Queries already done (e.g. before a crash) are not repeated. The dust
+    #lookups are not cached, the extinction grid already keeps them
+    cache = QueryCache(args.cache)
+    simbadQuery = cache.cached('simbad', simbadQuery, radius='15s')
+    #the failed Gaia queries raise in gaiaQuery, and are NULL only after the
+    #cache, in GAIAplx
+    gaiaQuery = cache.cached('gaia', gaiaQuery, radius='10s')
+    log = RunLog()
+    if args.batch:
+        with profile(args.profile):
+            batch(stars, exo_all, output, review=args.review, workers=args.workers,
+                  services={'simbad': simbadQuery, 'gaia': gaiaQuery, 'dust': dustQuery},
+                  log=log)
+        print('Cache: ' + cache.summary())
+        if args.log:
+            log.save(args.log)
+        raise SystemExit()
+    simbadQuery = log.timed('simbad', simbadQuery)
+    GAIAplx = log.timed('gaia', GAIAplx)
+    dustQuery = log.timed('dust', dustQuery)
+    with profile(args.profile):
+        interactive(stars, exo_all, output, log)
+    print('Cache: ' + cache.summary())
+    if args.log:
+        log.save(args.log)
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+# Benchmarks of the derived parameters and the crossmatch, on synthetic
+# catalogues. Example:
+#
+#   python benchmark.py run -o before.json
+#   python benchmark.py run -o after.json
+#   python benchmark.py compare before.json after.json
+#
+from __future__ import division, print_function
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from catalogue import writeRDB
+from exotable import writeTable
+from sexagesimal import deg2dec, deg2ra
+
+
+# Stars in SWEET-Cat and planets in exoplanet.eu at scale 1, and the number
+# of stars for the Monte Carlo benchmarks (10000 trials each) at scale 1
+NSTARS = 3000
+NPLANETS = 4000
+NMONTECARLO = 100
+# Number of calls of the functions for a single star at scale 1
+NCALLS = 10
+SCALES = (1, 10, 100)
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function gets the scale and a
+    Catalogues and returns the function to time and the number of calls and
+    stars it does.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def stars(n, seed=0):
+    """ Random spectroscopic parameters for n stars """
+    rng = np.random.RandomState(seed)
+    return {'teff': rng.uniform(4500., 6500., n),
+            'erteff': rng.uniform(20., 100., n),
+            'logg': rng.uniform(3.8, 4.6, n),
+            'erlogg': rng.uniform(0.02, 0.2, n),
+            'feh': rng.uniform(-0.5, 0.4, n),
+            'erfeh': rng.uniform(0.01, 0.1, n),
+            'vmag': rng.uniform(5., 13., n),
+            'ervmag': rng.uniform(0.01, 0.05, n),
+            'mass': rng.uniform(0.7, 1.3, n),
+            'ermass': rng.uniform(0.02, 0.1, n),
+            'Av': rng.uniform(0., 0.3, n),
+            'erAv': rng.uniform(0.01, 0.05, n)}
+
+
+class Catalogues:
+    """
+    Synthetic WEBSITE_online.rdb and exo.csv in a temporary directory, one
+    directory per scale. All the SWEET-Cat stars have planets and 5% of the
+    planets are around new stars.
+    """
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='sweetcat-benchmark-')
+        self.dirs = {}
+
+    def directory(self, scale):
+        if scale not in self.dirs:
+            path = os.path.join(self.root, str(scale))
+            os.makedirs(path)
+            self._write(path, NSTARS*scale, NPLANETS*scale)
+            self.dirs[scale] = path
+        return self.dirs[scale]
+
+    def _write(self, path, nstars, nplanets, seed=0):
+        rng = np.random.RandomState(seed)
+        ra = rng.uniform(0., 360., nstars)
+        dec = np.degrees(np.arcsin(rng.uniform(-1., 1., nstars)))
+        p = stars(nstars, seed)
+        sc = pd.DataFrame({'name': ['Star %d' % i for i in range(nstars)],
+                           'hd': np.where(rng.rand(nstars) < 0.3,
+                                          np.arange(nstars).astype(str), 'NULL'),
+                           'ra': deg2ra(ra), 'dec': deg2dec(dec),
+                           'V': p['vmag'], 'Verr': p['ervmag'],
+                           'p': rng.uniform(1., 100., nstars), 'perr': 0.1,
+                           'pflag': 'GAIADR2', 'Teff': np.round(p['teff']),
+                           'Tefferr': np.round(p['erteff']), 'logg': p['logg'],
+                           'logger': p['erlogg'], 'n1': np.nan, 'n2': np.nan,
+                           'vt': 1., 'vterr': 0.1, 'feh': p['feh'],
+                           'feherr': p['erfeh'], 'M': p['mass'], 'Merr': p['ermass'],
+                           'author': 'Synthetic', 'link': 'NULL', 'source': '1',
+                           'update': '2018-07-30', 'comment': 'NULL'})
+        sc['n3'] = sc.name
+        writeRDB(sc, os.path.join(path, 'WEBSITE_online.rdb'))
+        host = rng.permutation(np.r_[np.arange(min(nstars, nplanets)),
+                                     rng.randint(0, nstars, max(nplanets - nstars, 0))])
+        known = rng.rand(nplanets) < 0.95
+        exo = pd.DataFrame({
+            'name': [(n if k else 'New %d' % i) + ' b' for i, (n, k) in
+                     enumerate(zip(sc.name.values[host], known))],
+            'ra': np.where(known, ra[host], rng.uniform(0., 360., nplanets)),
+            'dec': np.where(known, dec[host], rng.uniform(-90., 90., nplanets)),
+            'detection_type': 'Radial Velocity',
+            'planet_status': 'Confirmed',
+            'updated': '2018-07-30'})
+        writeTable(exo, os.path.join(path, 'exo.csv'))
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def inside(path):
+    """ Run in another directory, without printing anything """
+    cwd = os.getcwd()
+    sys.stdout.flush()
+    stdout = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.chdir(path)
+    try:
+        # clint writes to the original stdout, so redirect the descriptor
+        os.dup2(devnull, 1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(stdout, 1)
+        os.close(stdout)
+        os.close(devnull)
+        os.chdir(cwd)
+
+
+@benchmark('TorresMass.massTorres')
+def _massTorres(scale, catalogues):
+    from TorresMass import massTorres
+    p = stars(NCALLS*scale)
+    args = [p[k] for k in ('teff', 'erteff', 'logg', 'erlogg', 'feh', 'erfeh')]
+    def run():
+        for i in range(args[0].size):
+            massTorres(*[x[i] for x in args])
+    return run, args[0].size, args[0].size
+
+
+@benchmark('TorresMass.massTorresBatch')
+def _massTorresBatch(scale, catalogues):
+    from TorresMass import massTorresBatch
+    p = stars(NMONTECARLO*scale)
+    args = [p[k] for k in ('teff', 'erteff', 'logg', 'erlogg', 'feh', 'erfeh')]
+    return lambda: massTorresBatch(*args), 1, args[0].size
+
+
+@benchmark('TorresMass.radTorres')
+def _radTorres(scale, catalogues):
+    from TorresMass import radTorres
+    p = stars(NCALLS*scale)
+    args = [p[k] for k in ('teff', 'erteff', 'logg', 'erlogg', 'feh', 'erfeh')]
+    def run():
+        for i in range(args[0].size):
+            radTorres(*[x[i] for x in args])
+    return run, args[0].size, args[0].size
+
+
+@benchmark('TorresMass.radTorresBatch')
+def _radTorresBatch(scale, catalogues):
+    from TorresMass import radTorresBatch
+    p = stars(NMONTECARLO*scale)
+    args = [p[k] for k in ('teff', 'erteff', 'logg', 'erlogg', 'feh', 'erfeh')]
+    return lambda: radTorresBatch(*args), 1, args[0].size
+
+
+@benchmark('TorresMass.radTorresBatch (adaptive)')
+def _radTorresAdaptive(scale, catalogues):
+    from TorresMass import radTorresBatch
+    p = stars(NMONTECARLO*scale)
+    args = [p[k] for k in ('teff', 'erteff', 'logg', 'erlogg', 'feh', 'erfeh')]
+    return lambda: radTorresBatch(*args, method='adaptive'), 1, args[0].size
+
+
+@benchmark('TorresMass.radTorresBatch (linear)')
+def _radTorresLinear(scale, catalogues):
+    from TorresMass import radTorresBatch
+    p = stars(NSTARS*scale)
+    args = [p[k] for k in ('teff', 'erteff', 'logg', 'erlogg', 'feh', 'erfeh')]
+    return lambda: radTorresBatch(*args, method='linear'), 1, args[0].size
+
+
+@benchmark('ParallaxSpec.bolcor')
+def _bolcor(scale, catalogues):
+    from ParallaxSpec import bolcor
+    teff = stars(NSTARS*scale)['teff']
+    return lambda: bolcor(teff), 1, teff.size
+
+
+@benchmark('ParallaxSpec.parallax')
+def _parallax(scale, catalogues):
+    from ParallaxSpec import parallax
+    p = stars(NCALLS*scale)
+    args = [p[k] for k in ('teff', 'erteff', 'logg', 'erlogg', 'vmag', 'ervmag',
+                           'mass', 'ermass', 'Av', 'erAv')]
+    def run():
+        for i in range(args[0].size):
+            parallax(*[x[i] for x in args])
+    return run, args[0].size, args[0].size
+
+
+@benchmark('ParallaxSpec.parallax (arrays)')
+def _parallaxBatch(scale, catalogues):
+    from ParallaxSpec import parallax
+    p = stars(NMONTECARLO*scale)
+    args = [p[k] for k in ('teff', 'erteff', 'logg', 'erlogg', 'vmag', 'ervmag',
+                           'mass', 'ermass', 'Av', 'erAv')]
+    return lambda: parallax(*args), 1, args[0].size
+
+
+@benchmark('SC_exoplanet.radTorres')
+def _scRadTorres(scale, catalogues):
+    with contextlib.redirect_stdout(io.StringIO()):
+        from SC_exoplanet import radTorres
+    p = stars(NSTARS*scale)
+    args = [p[k] for k in ('teff', 'erteff', 'logg', 'erlogg', 'feh', 'erfeh')]
+    return lambda: radTorres(*args), 1, args[0].size
+
+
+@benchmark('checkExoplanet.Update.readSC')
+def _readSC(scale, catalogues):
+    from checkExoplanet import Update
+    path = catalogues.directory(scale)
+    new = Update.__new__(Update)
+    def run():
+        with inside(path):
+            new.readSC()
+    return run, 1, NSTARS*scale
+
+
+@benchmark('checkExoplanet.Update.update')
+def _update(scale, catalogues):
+    from checkExoplanet import Update
+    path = catalogues.directory(scale)
+    with inside(path):
+        new = Update(controversial=False, download=False)
+    def run():
+        with inside(path):
+            new.update(full=True)
+    return run, 1, (NSTARS + NPLANETS)*scale
+
+
+@benchmark('checkExoplanet.Update.update (delta)')
+def _updateIncremental(scale, catalogues):
+    from changeset import Snapshot
+    from checkExoplanet import Update
+    path = catalogues.directory(scale)
+    with inside(path):
+        new = Update(controversial=False, download=False)
+        # The snapshot of a previous run, with 1% of the planets changed since
+        old = new.exoplanet.copy()
+        changed = np.random.RandomState(2).rand(len(old)) < 0.01
+        old.loc[changed, 'ra'] += 0.01
+        old.loc[changed, 'updated'] = '2018-01-01'
+        Snapshot('exo_snapshot_old.pkl').save(old, SC=new.SC, mtime=new.sc_mtime)
+    def run():
+        with inside(path):
+            # Every run starts from the same snapshot
+            shutil.copy('exo_snapshot_old.pkl', new.snapshot)
+            new.update()
+    return run, 1, int(changed.sum())
+
+
+@benchmark('service.Catalogue.name')
+def _serviceName(scale, catalogues):
+    from service import Catalogue
+    path = catalogues.directory(scale)
+    with inside(path):
+        catalogue = Catalogue()
+    names = ['Star %d' % i for i in range(NCALLS*scale)]
+    def run():
+        for name in names:
+            catalogue.name(name)
+    return run, len(names), len(names)
+
+
+@benchmark('service.Catalogue.cone')
+def _serviceCone(scale, catalogues):
+    from service import Catalogue
+    path = catalogues.directory(scale)
+    with inside(path):
+        catalogue = Catalogue()
+    p = np.random.RandomState(1).uniform(0., 90., (2, NCALLS*scale))
+    def run():
+        for ra, dec in p.T:
+            catalogue.cone(ra, dec, 600.)
+    return run, p.shape[1], p.shape[1]
+
+
+def measure(run, repeat=3):
+    """ Best time of repeat runs and the peak memory (in bytes) of one more """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def _commit():
+    """ The git commit of the working tree, if any """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales=SCALES, select=None, repeat=3):
+    """
+    Run the benchmarks
+
+    Parameters
+    ----------
+    scales : list
+        The sizes of the synthetic catalogues, relative to SWEET-Cat and
+        exoplanet.eu today.
+    select : str
+        Only run the benchmarks with this in their name.
+    repeat : int
+        Number of timed runs, the best is kept.
+
+    Returns
+    -------
+    report : dict
+        The environment (meta) and a result per benchmark and scale.
+    """
+    catalogues = Catalogues()
+    results = []
+    try:
+        for scale in scales:
+            for name, setup in BENCHMARKS:
+                if select and select not in name:
+                    continue
+                func, calls, nstars = setup(scale, catalogues)
+                seconds, peak = measure(func, repeat)
+                results.append({'name': name, 'scale': scale, 'calls': calls,
+                                'stars': nstars, 'seconds': seconds,
+                                'per_call': seconds/calls,
+                                'stars_per_second': nstars/seconds,
+                                'peak_memory': peak})
+                print('%-38s x%-4d %10.4f s %12.0f stars/s %9.1f MB' %
+                      (name, scale, seconds, nstars/seconds, peak/1e6))
+    finally:
+        catalogues.close()
+    meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': _commit(),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'repeat': repeat}
+    return {'meta': meta, 'results': results}
+
+
+def compare(old, new, threshold=0.1):
+    """
+    Compare two reports. Return the benchmarks that are slower (or use more
+    memory) by more than the threshold (a fraction).
+    """
+    before = dict(((r['name'], r['scale']), r) for r in old['results'])
+    regressions = []
+    print('%-38s %-5s %10s %10s %8s %8s' % ('Benchmark', 'Scale', 'Before [s]',
+                                             'After [s]', 'Time', 'Memory'))
+    for r in new['results']:
+        key = (r['name'], r['scale'])
+        if key not in before:
+            continue
+        time_ratio = r['seconds'] / before[key]['seconds']
+        memory_ratio = r['peak_memory'] / max(before[key]['peak_memory'], 1)
+        flag = ''
+        if time_ratio > 1 + threshold or memory_ratio > 1 + threshold:
+            regressions.append(key)
+            flag = '  <-- regression'
+        print('%-38s x%-4d %10.4f %10.4f %7.2fx %7.2fx%s' %
+              (r['name'], r['scale'], before[key]['seconds'], r['seconds'],
+               time_ratio, memory_ratio, flag))
+    return regressions
+
+
+def _parse():
+    p = argparse.ArgumentParser(description='Benchmark the derived parameters and the crossmatch')
+    sub = p.add_subparsers(dest='command')
+    r = sub.add_parser('run', help='Run the benchmarks')
+    r.add_argument('-o', '--output', help='Save the results to a JSON file')
+    r.add_argument('-s', '--scales', help='Sizes of the catalogues relative to today',
+                   type=int, nargs='+', default=list(SCALES))
+    r.add_argument('-k', '--select', help='Only run the benchmarks with this in the name')
+    r.add_argument('-r', '--repeat', help='Number of timed runs', type=int, default=3)
+    c = sub.add_parser('compare', help='Compare two results')
+    c.add_argument('before', help='JSON file with the reference results')
+    c.add_argument('after', help='JSON file with the new results')
+    c.add_argument('-t', '--threshold', help='Fraction slower to be a regression',
+                   type=float, default=0.1)
+    args = p.parse_args()
+    if args.command is None:
+        p.error('choose run or compare')
+    return args
+
+
+def main():
+    args = _parse()
+    if args.command == 'run':
+        report = run(args.scales, args.select, args.repeat)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+    else:
+        with open(args.before) as f:
+            old = json.load(f)
+        with open(args.after) as f:
+            new = json.load(f)
+        if compare(old, new, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
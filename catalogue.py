@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import os
+import numpy as np
+import pandas as pd
+from sexagesimal import dec2deg, ra2deg
+try:
+    import pyarrow
+    from pyarrow import feather
+except ImportError:
+    pyarrow = None
+
+
+# The columns of WEBSITE_online.rdb
+NAMES = ['name', 'hd', 'ra', 'dec', 'V', 'Verr', 'p', 'perr',
+         'pflag', 'Teff', 'Tefferr', 'logg', 'logger',
+         'n1', 'n2', 'vt', 'vterr', 'feh', 'feherr', 'M', 'Merr',
+         'author', 'link', 'source', 'update', 'comment', 'n3']
+NUMERIC = ['V', 'Verr', 'p', 'perr', 'Teff', 'Tefferr', 'logg', 'logger',
+           'n1', 'n2', 'vt', 'vterr', 'feh', 'feherr', 'M', 'Merr']
+CATEGORICAL = ['pflag', 'source']
+# The coordinates in degrees, added to the catalogue when it is read
+DEGREES = ['radeg', 'decdeg']
+# The line of each row as read, to write the values that did not change
+# with their original text
+LINE = 'line'
+# Minimum number of decimals written for the new numeric values
+DECIMALS = dict([(column, 2) for column in NUMERIC], Teff=0, Tefferr=0)
+NULL = 'NULL'
+
+
+def _typed(df):
+    """ Apply the schema to a table of strings """
+    df = df.where(df != NULL)
+    for column in NUMERIC:
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype(float)
+    for column in CATEGORICAL:
+        df[column] = df[column].astype('category')
+    return df
+
+
+def iterRDB(fname, chunksize=10000):
+    """
+    Read a SWEET-Cat rdb file in chunks
+
+    Rows with missing trailing fields are filled with NULL and extra
+    trailing fields are ignored. NULL is read as NaN. The line of each row
+    is kept in the column LINE, see writeRDB.
+
+    Parameters
+    ----------
+    fname : str
+        The rdb file.
+    chunksize : int
+        Number of rows in each chunk.
+
+    Yields
+    ------
+    df : DataFrame
+        The rows of a chunk, with the columns in NAMES and LINE.
+    """
+    n = len(NAMES)
+    rows = []
+    empty = True
+    with open(fname, encoding='utf8') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            rows.append((line.split('\t') + [NULL]*n)[:n] + [line])
+            if len(rows) == chunksize:
+                yield _typed(pd.DataFrame(rows, columns=NAMES + [LINE]))
+                rows = []
+                empty = False
+    if rows or empty:
+        yield _typed(pd.DataFrame(rows, columns=NAMES + [LINE]))
+
+
+def _sidecar(fname):
+    """ Name of the binary copy of an rdb file """
+    return fname + '.feather'
+
+
+def readRDB(fname='WEBSITE_online.rdb', sidecar=True):
+    """
+    Read a SWEET-Cat rdb file with the schema applied: numeric columns as
+    floats (NULL as NaN) and the flags as categoricals. The coordinates are
+    also given in degrees (radeg and decdeg).
+
+    If pyarrow is installed, a binary copy (fname + '.feather') is kept
+    next to the rdb file and refreshed whenever the rdb file is newer. The
+    table (with the coordinates in degrees) is then memory mapped from it
+    instead of parsed.
+
+    Parameters
+    ----------
+    fname : str
+        The rdb file.
+    sidecar : bool
+        Use (and refresh) the binary copy.
+
+    Returns
+    -------
+    df : DataFrame
+        The catalogue.
+    """
+    binary = _sidecar(fname)
+    sidecar = sidecar and pyarrow is not None
+    if sidecar and os.path.isfile(binary) and \
+            os.path.getmtime(binary) >= os.path.getmtime(fname):
+        table = feather.read_table(binary, memory_map=True)
+        # Written before the coordinates in degrees and the lines were added
+        if all(column in table.column_names for column in DEGREES + [LINE]):
+            return table.to_pandas()
+    df = pd.concat(iterRDB(fname), ignore_index=True)
+    for column in CATEGORICAL:
+        df[column] = df[column].astype(object).astype('category')
+    df['radeg'] = ra2deg(df.ra.values)
+    df['decdeg'] = dec2deg(df.dec.values)
+    if sidecar:
+        try:
+            df.to_feather(binary)
+        except (IOError, pyarrow.ArrowException):
+            pass
+    return df
+
+
+def formatValue(value, decimals=0):
+    """
+    Format a value for an rdb file. NaN and None are written as NULL and
+    floats with at least the given number of decimals.
+    """
+    if value is None:
+        return NULL
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return NULL
+        value = '%.10g' % value
+        if 'e' not in value and 'n' not in value:
+            n = len(value.partition('.')[2])
+            if n < decimals:
+                value = value.rstrip('.') + '.'[n > 0:] + '0'*(decimals - n)
+        return value
+    return str(value)
+
+
+def formatRow(values):
+    """ Tab separated line of an rdb file, with a value per column in NAMES """
+    decimals = [DECIMALS.get(column, 0) for column in NAMES]
+    decimals += [0]*(len(values) - len(decimals))
+    return '\t'.join(map(formatValue, values, decimals))
+
+
+def _same(text, value):
+    """ True if the text of a field in an rdb file is the value """
+    if formatValue(value) == text:
+        return True
+    if isinstance(value, (float, np.floating)):
+        try:
+            number = float(text)
+        except ValueError:
+            return False
+        return number == value or (np.isnan(number) and np.isnan(value))
+    return False
+
+
+def _keepRow(values, line):
+    """
+    The line of a row read from an rdb file, with only the fields that
+    changed formatted again
+    """
+    fields = line.split('\t')
+    new = fields + [NULL]*(len(NAMES) - len(fields))
+    changed = False
+    for i, value in enumerate(values):
+        if not _same(new[i], value):
+            new[i] = formatValue(value, DECIMALS.get(NAMES[i], 0))
+            changed = True
+    if not changed:
+        return line
+    # Missing trailing fields stay missing if they are still NULL
+    if len(fields) < len(NAMES) and all(x == NULL for x in new[len(fields):len(NAMES)]):
+        new = new[:len(fields)]
+    return '\t'.join(new)
+
+
+def writeRDB(df, fname):
+    """
+    Write a catalogue to an rdb file (NaN is written as NULL). The values of
+    the rows read with readRDB that did not change are written with their
+    original text, so a file read and written again is unchanged.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The catalogue, with the columns in NAMES (and LINE, see iterRDB).
+    fname : str
+        The rdb file.
+    """
+    lines = df[LINE].values if LINE in df else [None]*len(df)
+    with open(fname, 'w', encoding='utf8') as f:
+        f.write('\n'.join(_keepRow(row, line) if isinstance(line, str) else formatRow(row)
+                           for row, line in zip(df[NAMES].itertuples(index=False), lines)))
+
+
+def appendRDB(fname, rows):
+    """
+    Append rows to an rdb file
+
+    Parameters
+    ----------
+    fname : str
+        The rdb file.
+    rows : list
+        List of rows, each one a list with a value per column.
+    """
+    with open(fname, 'a', encoding='utf8') as f:
+        for row in rows:
+            f.write('\n' + formatRow(row))
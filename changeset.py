@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import os
+import numpy as np
+import pandas as pd
+from catalogue import LINE
+from nameindex import normalize
+
+
+# The column with the date a planet was last updated in exoplanet.eu
+UPDATED = 'updated'
+# The columns of the snapshot, besides the hash of the stellar fields
+COLUMNS = ['star_name', 'ra', 'dec', UPDATED]
+
+
+def stellar(df):
+    """ The columns of the exoplanet.eu table with the host parameters """
+    return [column for column in df.columns if column.startswith('star_')
+            or column.startswith('mag_') or column in ('ra', 'dec')]
+
+
+def _hash(df):
+    """ Hash of the stellar fields of each planet """
+    return pd.util.hash_pandas_object(df[stellar(df)].astype(str), index=False).values
+
+
+def _schash(SC):
+    """ Hash of each row of SWEET-Cat, indexed by the normalized name """
+    hashes = pd.Series(pd.util.hash_pandas_object(SC.drop(columns=LINE, errors='ignore').astype(str),
+                                                 index=False).values,
+                       index=normalize(SC['name']).values)
+    return hashes[~hashes.index.duplicated(keep='last')]
+
+
+def _table(exoplanet):
+    """ The exoplanet.eu table indexed by planet name (the last of duplicates) """
+    df = exoplanet.drop_duplicates('name', keep='last').set_index('name')
+    if UPDATED not in df:
+        df[UPDATED] = ''
+    df[UPDATED] = df[UPDATED].astype(str)
+    return df
+
+
+class Changes:
+    """ Names of the planets added, removed and with changed stellar fields """
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def table(self):
+        """ A row per planet with the change """
+        return pd.concat([pd.DataFrame({'planet': names, 'change': change})
+                          for names, change in ((self.added, 'added'),
+                                                (self.removed, 'removed'),
+                                                (self.changed, 'changed'))],
+                         ignore_index=True)
+
+
+class Snapshot:
+    """
+    The state of exoplanet.eu when it was last processed: for each planet
+    the host name, coordinates, the updated column and a hash of the
+    stellar fields. Only the planets with a new updated value are hashed
+    again, so comparing a new table scales with the number of changes.
+
+    The state of SWEET-Cat is kept too, as the modification time of the
+    file and a hash of each row, so the stars added or changed in SWEET-Cat
+    since are checked again. The rows are only hashed if the file changed.
+    """
+    def __init__(self, fname='exo_snapshot.pkl'):
+        self.fname = fname
+        self.table = None
+        # Hash of each SWEET-Cat row and the modification time of the file
+        self.sc = None
+        self.sc_mtime = None
+        self._sc_new = None
+        if os.path.isfile(fname):
+            state = pd.read_pickle(fname)
+            # Snapshots from before SWEET-Cat was tracked are only the table
+            if isinstance(state, pd.DataFrame):
+                state = {'exo': state}
+            self.table = state['exo']
+            self.sc = state.get('sc')
+            self.sc_mtime = state.get('sc_mtime')
+
+    def changes(self, exoplanet):
+        """
+        The changes in the exoplanet.eu table since the snapshot (None if
+        there is no snapshot yet)
+        """
+        if self.table is None:
+            return None
+        new = _table(exoplanet)
+        old = self.table
+        added = new.index.difference(old.index)
+        removed = old.index.difference(new.index)
+        common = new.index.intersection(old.index)
+        # Without an updated column, all the common planets are hashed
+        touched = common[(new.loc[common, UPDATED] != old.loc[common, UPDATED]).values
+                         | (new.loc[common, UPDATED] == '').values]
+        changed = touched[_hash(new.loc[touched]) != old.loc[touched, 'hash'].values]
+        return Changes(added, removed, changed)
+
+    def scChanges(self, SC, mtime=None):
+        """
+        Rows of SWEET-Cat added or changed since the snapshot (all of them
+        if SWEET-Cat was not tracked yet), given the modification time of
+        the file
+        """
+        if self.sc is not None and mtime is not None and mtime == self.sc_mtime:
+            return np.array([], dtype=int)
+        self._sc_new = _schash(SC)
+        if self.sc is None:
+            return np.arange(len(SC))
+        names = normalize(SC['name']).values
+        old = self.sc.reindex(names).values
+        new = self._sc_new.reindex(names).values
+        return np.where(pd.isnull(old) | (old != new))[0]
+
+
+    def save(self, exoplanet, changes=None, SC=None, mtime=None):
+        """
+        Save the new state, hashing only the planets that changed, and the
+        state of SWEET-Cat if given (see scChanges)
+        """
+        new = _table(exoplanet)
+        table = new.reindex(columns=COLUMNS)
+        table['hash'] = pd.Series(0, index=table.index, dtype='uint64')
+        if self.table is None or changes is None:
+            rehash = new.index
+        else:
+            # get_indexer is a hash lookup, isin is slow on string indexes
+            rehash = new.index[(self.table.index.get_indexer(new.index) < 0)
+                               | (changes.changed.get_indexer(new.index) >= 0)]
+            keep = new.index.difference(rehash)
+            table.loc[keep, 'hash'] = self.table.loc[keep, 'hash'].values
+        table.loc[rehash, 'hash'] = _hash(new.loc[rehash])
+        if SC is not None and (self.sc is None or mtime is None or mtime != self.sc_mtime):
+            self.sc = self._sc_new if self._sc_new is not None else _schash(SC)
+            self.sc_mtime = mtime
+        pd.to_pickle({'exo': table, 'sc': self.sc, 'sc_mtime': self.sc_mtime}, self.fname)
+        self.table = table
@@ -1,13 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf8 -*-
-from urllib.request import urlopen
+import argparse
+import os
 import pandas as pd
 import numpy as np
 import time
 from astropy.io import votable
 import warnings
-from astropy import coordinates as coord
-from astropy import units as u
+from catalogue import readRDB
+from changeset import Snapshot
+from crossmatch import SkyIndex, matchChunks
+from download import download
+from exotable import readTable, writeTable
+from nameindex import NameIndex, normalize, strip_planet
+from runlog import RunLog, profile
+from Simbad import SIMBAD_TAP, query as simbadQuery
 # For fun, but still useful
 from clint.textui import puts, colored
 warnings.simplefilter("ignore")
@@ -15,6 +22,9 @@ from io import open
 from six import indexbytes
 
 
+EXOPLANET_URL = 'http://exoplanet.eu/catalog/votable'
+
+
 def writeFile(fname, data):
     """ Write data to a file """
     with open(fname, 'w') as f:
@@ -23,34 +33,70 @@ def writeFile(fname, data):
 
 class Update:
     """ Check for updates to SWEET-Cat comparing with exoplanet.eu """
-    def __init__(self, controversial, download = False):
+    def __init__(self, controversial, download = False, url = EXOPLANET_URL, log = None,
+                 workers = None, chunksize = 50000, simbad = False, simbad_url = SIMBAD_TAP):
+        # Also check the unconfirmed and candidate planets (exo_cont.csv)
         self.controversial = controversial
         self.download = download
+        self.url = url
         self.fname = 'exo.csv'
+        self.fname_cont = 'exo_cont.csv'
+        # Positions matched at once, and the processes for them
+        self.workers = workers
+        self.chunksize = chunksize
+        # The state of exoplanet.eu in the last run, the changes since, the
+        # new hosts and (in controversial mode) the matches with their status
+        suffix = '_cont' if controversial else ''
+        self.snapshot = 'exo_snapshot%s.pkl' % suffix
+        self.changes = 'changes%s.csv' % suffix
+        self.names = 'names%s.txt' % suffix
+        self.matches = 'matches_cont.csv'
         self.blacklist = []
+        # Time and size of each stage
+        self.log = RunLog() if log is None else log
         # Kapteyn's can't be added with the ' in the website
-        self.readSC()
+        with self.log.stage('readSC') as record:
+            self.readSC()
+            record['rows'] = len(self.sc_names)
+        # The Simbad identifiers of the stars, e.g. the HIP name of a HD star
+        self.simbad_ids = 'simbad_ids.csv'
+        if simbad:
+            with self.log.stage('simbad ids') as record:
+                record['rows'] = self.simbadAliases(simbad_url)
         self.downloadExoplanet()
 
 
     def downloadExoplanet(self):
         """
         Download the table from exoplanetEU and save it to a file (exo.csv).
+        In controversial mode the unconfirmed and candidate planets
+        (exo_cont.csv) are checked too.
+        The table is only downloaded and parsed again if it changed.
         Return a pandas DataFrame sorted in 'update'.
         """
         if self.download:
-            response = urlopen("http://exoplanet.eu/catalog/votable")
-            table = response.read()
-            with open("exo.xml", "wb") as f:
-                f.write(table)
-            self.xml2csv()
-        df = pd.read_csv(self.fname)
+            with self.log.stage('download') as record:
+                changed = download(self.url, 'exo.xml')
+                record['changed'] = changed
+            if changed or not os.path.isfile(self.fname):
+                with self.log.stage('xml2csv'):
+                    self.xml2csv()
+        with self.log.stage('readTable') as record:
+            df = readTable(self.fname)
+            if self.controversial:
+                df = pd.concat([df, readTable(self.fname_cont)], ignore_index=True)
+            record['rows'] = len(df)
+        if 'planet_status' not in df:
+            df['planet_status'] = 'Confirmed'
         df = df[(df.detection_type == 'Radial Velocity') \
                 | (df.detection_type == 'Primary Transit') \
                 | (df.detection_type == 'Astrometry')]
-        self.exoplanet = df
-        names=map(lambda x: self.remove_planet(x),self.exoplanet['name'])
-        self.exo_names = map(lambda x: x.strip(), names)
+        self.exoplanet = df.reset_index(drop=True)
+        with self.log.stage('exo names') as record:
+            self.exo_names = list(strip_planet(self.exoplanet['name']))
+            self.exo_index = NameIndex(self.exo_names)
+            self.exo_keys = normalize(self.exo_names)
+            record['rows'] = len(self.exo_names)
 
 
     def xml2csv(self):
@@ -61,39 +107,61 @@ class Update:
             vo = vo.get_first_table().to_table(use_names_over_ids=True)
             df = vo.to_pandas()
             #Divide the data in Confirmed and not.
-            df[df.planet_status == 'Confirmed'].to_csv('exo.csv', index=False)
-            df[(df.planet_status == 'Unconfirmed') \
-               | (df.planet_status == 'Candidate')].to_csv('exo_cont.csv', index=False)
+            writeTable(df[df.planet_status == 'Confirmed'], 'exo.csv')
+            writeTable(df[(df.planet_status == 'Unconfirmed') \
+                          | (df.planet_status == 'Candidate')], 'exo_cont.csv')
 
 
     def remove_planet(self, name):
         """ Remove the trailing b, c, d, etc in the stellar name """
-        planets = 'bcdefghijB'
-        for planet in planets:
-            if name.endswith(' %s' % planet):
-                
-                return name[:-2]
-        #some exoplanets have .01 or .02 in the name 
-        if name.endswith('.01') or name.endswith('.02') or name.endswith('.2'):
-            return name[:-3]                
-        return name
+        return strip_planet([name])[0]
 
 
     def readSC(self):
-        names_ = ['name', 'hd', 'ra', 'dec', 'V', 'Verr', 'p', 'perr',
-                  'pflag', 'Teff', 'Tefferr', 'logg', 'logger',
-                  'n1', 'n2', 'vt', 'vterr', 'feh', 'feherr', 'M', 'Merr',
-                  'author', 'link', 'source', 'update', 'comment', 'n3']
-        SC = pd.read_csv('WEBSITE_online.rdb', delimiter='\t', names=names_)
-        self.sc_names = map(lambda x: x.lower().replace(' ', '').replace('-', ''), SC.name)
-        self.sc_names = map(str.strip, self.sc_names)
-        self.sc_names_orig = map(lambda x: x.strip(), SC.name)
-        self.coordinates = SC.loc[:, ['ra', 'dec']]
+        # The modification time before reading, to see later changes
+        self.sc_mtime = os.stat('WEBSITE_online.rdb').st_mtime_ns
+        SC = readRDB('WEBSITE_online.rdb')
+        self.SC = SC
+        self.sc_names = list(normalize(SC.name))
+        self.sc_names_orig = list(SC.name.str.strip())
+        self.sc_index = NameIndex.from_catalogue(SC)
+        self.coordinates = SC.loc[:, ['ra', 'dec', 'radeg', 'decdeg']]
+        # Built when it is first needed
+        self.sc_sky = None
+
+
+    def simbadAliases(self, url=SIMBAD_TAP):
+        """
+        Add the Simbad identifiers (HD, GJ, HIP, WASP, KOI, ...) of the
+        SWEET-Cat stars to the name index. They are kept in simbad_ids.csv,
+        so only the stars not queried before are sent to Simbad (all in one
+        request). Return the number of stars queried.
+        """
+        if os.path.isfile(self.simbad_ids):
+            ids = pd.read_csv(self.simbad_ids, index_col='name', keep_default_na=False)['ids']
+        else:
+            ids = pd.Series([], dtype=object, index=pd.Index([], name='name'), name='ids')
+        missing = sorted(set(self.sc_names_orig) - set(ids.index))
+        if missing:
+            try:
+                found = simbadQuery(missing, url=url)['ids'].fillna('')
+            except (IOError, OSError) as e:
+                puts(colored.red('Simbad query failed, without the Simbad aliases: %s' % e))
+                found = None
+            if found is not None:
+                # The stars not in Simbad are kept empty, not to query them again
+                ids = pd.concat([ids, found])
+                ids[~ids.index.duplicated(keep='last')].to_csv(self.simbad_ids)
+        ids = ids[~ids.index.duplicated(keep='last')]
+        for row, name in enumerate(self.sc_names_orig):
+            if ids.get(name):
+                self.sc_index.add_ids(row, ids[name])
+        return len(missing)
 
 
     def _sccoordinates(self, idx):
         """
-        Transform the coordinates to degrees
+        The coordinates in degrees
         
         Parameters
         ----------
@@ -107,79 +175,225 @@ class Update:
         DEsc : float
              DEC in degrees
         """
-        aux = self.coordinates['ra'].values[idx]
-        RAsc = (float(aux[0:2])+float(aux[3:5])/60.+float(aux[6:])/3600.)*15.
-        aux = self.coordinates['dec'].values[idx]
-        if aux[0] == '-':
-            DEsc = float(aux[0:3])-float(aux[4:6])/60.-float(aux[7:])/3600.
-        else:
-            DEsc = float(aux[0:3])+float(aux[4:6])/60.+float(aux[7:])/3600.
+        RAsc = self.coordinates['radeg'].values[idx]
+        DEsc = self.coordinates['decdeg'].values[idx]
         return RAsc, DEsc
 
 
-    def update(self):
+    def _scrows(self, planets, table):
+        """
+        Rows in SWEET-Cat of the hosts of some planets, by name or by position
+        (within 5 arcsec) in table (the exoplanet.eu table or a snapshot)
+        """
+        rows = set()
+        for name in normalize(strip_planet(planets)):
+            if name in self.sc_index:
+                rows.add(self.sc_index.get(name))
+        table = table[~table.index.duplicated()]
+        position = table.reindex(planets)[['ra', 'dec']].values.astype(float)
+        if self.sc_sky is None:
+            self.sc_sky = SkyIndex(self.coordinates['radeg'].values,
+                                   self.coordinates['decdeg'].values)
+        matches = self.sc_sky.match(position[:, 0], position[:, 1], radius=5.)
+        rows.update(matches['match'].values)
+        return np.array(sorted(rows), dtype=int)
+
+
+    def _exorows(self, rows):
+        """
+        Rows in exoplanet.eu of the planets of some SWEET-Cat stars, by name
+        (or alias) or by position (within 5 arcsec)
+        """
+        keys = pd.Index(set(key for i in rows for key in self.sc_index.aliases(i)))
+        byname = np.where(keys.get_indexer(self.exo_keys) >= 0)[0]
+        matches = SkyIndex(self.exoplanet['ra'].values, self.exoplanet['dec'].values).match(
+            self.coordinates['radeg'].values[rows], self.coordinates['decdeg'].values[rows],
+            radius=5.)
+        return np.union1d(byname, matches['match'].values).astype(int)
+
+
+    def _matches(self, exo_rows, forward, status, changes=None):
+        """
+        Save the planets checked with their status and their host in
+        SWEET-Cat (the closest by position, or by name), if any. With the
+        changes of an incremental run, the planets not checked again are
+        kept from the last file and the removed ones are dropped.
+        """
+        nearest = forward.drop_duplicates('idx')
+        sc = np.full(len(exo_rows), -1)
+        sc[nearest['idx'].values] = nearest['match'].values
+        sep = np.full(len(exo_rows), np.nan)
+        sep[nearest['idx'].values] = nearest['sep'].values
+        names = normalize([self.exo_names[i] for i in exo_rows])
+        byname = np.array([self.sc_index.get(name) for name in names], dtype=int)
+        sc = np.where(sc >= 0, sc, byname)
+        sc_names = np.array(self.sc_names_orig + [''], dtype=object)
+        matches = pd.DataFrame({'planet': self.exoplanet['name'].values[exo_rows],
+                                'star': [self.exo_names[i] for i in exo_rows],
+                                'status': status[exo_rows],
+                                'sweetcat': sc_names[sc],
+                                'sep': sep})
+        if changes is not None and os.path.isfile(self.matches):
+            old = pd.read_csv(self.matches, keep_default_na=False, na_values=[''],
+                              dtype={'planet': str, 'star': str, 'sweetcat': str},
+                              float_precision='round_trip')
+            old = old[~old.planet.isin(matches.planet)]
+            #the row in exoplanet.eu of each planet kept, by name and by
+            #order among the planets with the same name
+            planets = pd.DataFrame({'planet': self.exoplanet['name'].values,
+                                    'row': np.arange(len(self.exoplanet))})
+            planets['n'] = planets.groupby('planet').cumcount()
+            old = old.assign(n=old.groupby('planet').cumcount().values)
+            old = old.merge(planets, on=['planet', 'n'], how='inner').drop(columns='n')
+            matches['row'] = exo_rows
+            #in the order of exoplanet.eu, as in a full run
+            matches = pd.concat([old, matches], ignore_index=True).sort_values('row')
+        matches.drop(columns='row', errors='ignore').to_csv(self.matches, index=False)
+
+
+    def update(self, full=False):
+        """
+        Find the new hosts, the hosts to remove and the hosts with changed
+        parameters in exoplanet.eu. Only the planets added, removed or changed
+        since the last run (see changeset.Snapshot) are checked, unless full
+        is True or there is no snapshot yet.
+        """
         #We have this already, but without the ' in the name.
         print('\n*** Matching data base ***')
+        snapshot = Snapshot(self.snapshot)
+        with self.log.stage('changes') as record:
+            changes = None if full else snapshot.changes(self.exoplanet)
+            record['rows'] = len(self.exoplanet) if changes is None else len(changes)
+        exo = self.exoplanet.set_index('name', drop=False)
+        if changes is None:
+            exo_rows = np.arange(len(self.exoplanet))
+            sc_rows = np.arange(len(self.coordinates))
+            changed_rows = np.array([], dtype=int)
+        else:
+            puts(' -> %d planets added, %d removed and %d changed since the last run' %
+                 (len(changes.added), len(changes.removed), len(changes.changed)))
+            exo_rows = np.where(changes.added.union(changes.changed).get_indexer(exo.index) >= 0)[0]
+            sc_rows = self._scrows(changes.removed.union(changes.changed),
+                                   pd.concat([snapshot.table, exo[['ra', 'dec']]]))
+            changed_rows = self._scrows(changes.changed, exo)
+            #stars added or changed in SWEET-Cat, and their planets
+            sc_changed = snapshot.scChanges(self.SC, self.sc_mtime)
+            if len(sc_changed):
+                puts(' -> %d stars added or changed in SWEET-Cat since the last run' %
+                     len(sc_changed))
+                sc_rows = np.union1d(sc_rows, sc_changed).astype(int)
+                exo_rows = np.union1d(exo_rows, self._exorows(sc_changed)).astype(int)
         NewStars = []
-        #from exoplanet.eu
-        coordExo = coord.SkyCoord(ra = self.exoplanet['ra'].values, 
-                                 dec = self.exoplanet['dec'].values, 
-                                 unit = (u.deg,u.deg), frame = 'icrs')
-        #from sweet-cat
-        coordSC = coord.SkyCoord(ra = self.coordinates['ra'].values, 
-                                dec = self.coordinates['dec'].values, 
-                                unit = (u.hourangle,u.deg), frame = 'icrs')
-        for i, exo_name in enumerate(self.exo_names):
-            new = exo_name
-            tmp = new.lower().replace(' ', '').replace('-', '') 
-            sep = coordExo[i].separation(coordSC).arcsecond
-            ind = np.where(sep<5.)[0]
-            if len(ind)==0:
-                try:
-                    #it didn't find by position but it finds by name
-                    position = self.sc_names.index(tmp)
-                except:
-                    position = -1
-                    #it didn't find by position and neither by name
+        #all the matches within 5 arcsec. The coordinates are in degrees in
+        #both (for SWEET-Cat, parsed when it is read)
+        #(in chunks in several processes for large tables)
+        with self.log.stage('crossmatch') as record:
+            forward = matchChunks(self.coordinates['radeg'].values,
+                                  self.coordinates['decdeg'].values,
+                                  self.exoplanet['ra'].values[exo_rows],
+                                  self.exoplanet['dec'].values[exo_rows], radius=5.,
+                                  chunksize=self.chunksize, workers=self.workers)
+            exo_matched = np.zeros(len(exo_rows), dtype=bool)
+            exo_matched[forward['idx'].values] = True
+            matches = matchChunks(self.exoplanet['ra'].values,
+                                  self.exoplanet['dec'].values,
+                                  self.coordinates['radeg'].values[sc_rows],
+                                  self.coordinates['decdeg'].values[sc_rows], radius=5.,
+                                  chunksize=self.chunksize, workers=self.workers)
+            sc_matched = np.zeros(len(sc_rows), dtype=bool)
+            sc_matched[matches['idx'].values] = True
+            record['rows'] = len(exo_rows) + len(sc_rows)
+        status = self.exoplanet['planet_status'].values
+        with self.log.stage('new stars') as record:
+            for i, matched in zip(exo_rows, exo_matched):
+                new = self.exo_names[i]
+                tmp = new.lower().replace(' ', '').replace('-', '') 
+                #it didn't find by position and neither by name
+                if not matched and (tmp not in self.sc_index):
                     if (tmp not in self.blacklist):
-                        NewStars.append(new)
-        NewStars = sorted(list(set(NewStars)))
+                        NewStars.append((new, status[i]))
+            #a host is confirmed if any of its new planets is
+            NewStatus = dict(sorted(NewStars, key=lambda star: star[1] == 'Confirmed'))
+            NewStars = sorted(NewStatus)
+            record['rows'] = len(NewStars)
+        if self.controversial:
+            with self.log.stage('matches') as record:
+                self._matches(exo_rows, forward, status, changes)
+                record['rows'] = len(forward)
         Nstars = len(NewStars)
         if Nstars:
             puts(' -> ' + colored.green(str(Nstars) + " new exoplanet available!"))
-            writeFile('names.txt', '\n'.join(NewStars))
+            if self.controversial:
+                for value, n in pd.Series(NewStatus).value_counts().items():
+                    puts('    %d %s' % (n, value))
             updated=False
         else:
             puts(colored.clean('*** No new updates available ***'))
             updated=True
+        if changes is not None and os.path.isfile(self.names):
+            #the hosts not added yet are kept, unless they were checked again
+            with open(self.names) as f:
+                old = set(f.read().split('\n')) - set([''])
+            rechecked = set(self.exo_names[i] for i in exo_rows) \
+                | set(strip_planet(changes.removed))
+            NewStars = sorted(set(NewStars) | (old - rechecked))
+        #the hosts added to SWEET-Cat since are done
+        NewStars = [star for star in NewStars if star not in self.sc_index]
+        writeFile(self.names, '\n'.join(NewStars))
         #removing planets that are not in Exoplanet.eu anymore
         NewStars = []
-        for i, scname in enumerate(self.sc_names_orig):
-            sep = coordSC[i].separation(coordExo).arcsecond
-            ind = np.where(sep<5.)[0]
-            if len(ind)==0:
-                try:
-                    #it didn't find by position but it finds by name
-                    position=self.exo_names.index(scname)
-                except:
-                    position = -1
-                    #it didn't find by position and neither by name
+        with self.log.stage('removed stars') as record:
+            for i, matched in zip(sc_rows, sc_matched):
+                scname = self.sc_names_orig[i]
+                tmp = self.sc_names[i]
+                #it didn't find by position and neither by name (or alias)
+                if not matched and \
+                        not any(k in self.exo_index.index for k in self.sc_index.aliases(i)):
                     if (tmp not in self.blacklist):
                         NewStars.append(scname)
-        NewStars = sorted(list(set(NewStars)))
+            NewStars = sorted(list(set(NewStars)))
+            record['rows'] = len(NewStars)
         Nstars = len(NewStars)
         if Nstars:
             puts(' -> ' + colored.green(str(Nstars) + " exoplanet has to be removed!\n"))
             print('\n'.join(NewStars))
         else:
             puts(colored.clean(' -> No planet to remove!'))
-            if updated:        
-                puts(colored.clean('*** SWEET-Cat is up to date ***'))
-                puts(colored.green('    Good job '))
+        #hosts in SWEET-Cat with new stellar parameters in exoplanet.eu
+        if len(changed_rows):
+            puts(' -> ' + colored.yellow(str(len(changed_rows)) +
+                                         ' hosts with changed parameters in exoplanet.eu'))
+            print('\n'.join(self.sc_names_orig[i] for i in changed_rows))
+        elif not Nstars and updated:
+            puts(colored.clean('*** SWEET-Cat is up to date ***'))
+            puts(colored.green('    Good job '))
+        if changes is not None:
+            changes.table().to_csv(self.changes, index=False)
+        snapshot.save(self.exoplanet, changes, self.SC, self.sc_mtime)
+
+
+def _parse():
+    p = argparse.ArgumentParser(description='Check for updates to SWEET-Cat comparing with exoplanet.eu')
+    p.add_argument('-f', '--full', help='Check all the planets, not only the changes since the last run',
+                   default=False, action='store_true')
+    p.add_argument('-c', '--controversial', help='Also check the unconfirmed and candidate planets',
+                   default=False, action='store_true')
+    p.add_argument('-w', '--workers', help='Number of processes for the crossmatch', type=int,
+                   default=None)
+    p.add_argument('-s', '--simbad', help='Also match the Simbad identifiers of the stars',
+                   default=False, action='store_true')
+    p.add_argument('-l', '--log', help='Save the time of each stage to a JSON (or .csv) file')
+    p.add_argument('-p', '--profile', help='Save cProfile stats of the run to a file')
+    return p.parse_args()
 
 
 if __name__ == '__main__':
+    args = _parse()
     with open('starnotfoundinsimbad.list', 'a') as f:
         f.write(str(time.strftime("%d-%m-%Y"))+'\n')
-    new = Update(controversial=False, download=True)
-    new.update()
+    with profile(args.profile):
+        new = Update(controversial=args.controversial, download=True, workers=args.workers,
+                     simbad=args.simbad)
+        new.update(full=args.full)
+    if args.log:
+        new.log.save(args.log)
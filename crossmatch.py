@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+def radec2xyz(ra, dec):
+    """
+    Transform equatorial coordinates to unit vectors
+
+    Parameters
+    ----------
+    ra, dec : array_like
+        Coordinates in degrees.
+
+    Returns
+    -------
+    xyz : ndarray
+        Array with shape (N, 3) of unit vectors.
+    """
+    ra = np.radians(np.atleast_1d(np.asarray(ra, dtype=float)))
+    dec = np.radians(np.atleast_1d(np.asarray(dec, dtype=float)))
+    cosdec = np.cos(dec)
+    return np.column_stack((cosdec*np.cos(ra), cosdec*np.sin(ra), np.sin(dec)))
+
+
+def chord2arcsec(chord):
+    """ Angular separation in arcsec from the chord between unit vectors """
+    return np.degrees(2*np.arcsin(np.clip(chord/2., 0, 1)))*3600.
+
+
+def arcsec2chord(sep):
+    """ Chord between unit vectors separated by an angle in arcsec """
+    return 2*np.sin(np.radians(np.asarray(sep, dtype=float)/3600.)/2.)
+
+
+class SkyIndex:
+    """
+    Spatial index (KD-tree on unit vectors) over a catalogue of positions.
+    Build it once and match any number of positions against it.
+    """
+    def __init__(self, ra, dec):
+        xyz = radec2xyz(ra, dec)
+        self.size = len(xyz)
+        # Positions that are not defined can never match
+        self.rows = np.where(np.isfinite(xyz).all(axis=1))[0]
+        self.tree = cKDTree(xyz[self.rows])
+
+
+    def match(self, ra, dec, radius=5.):
+        """
+        Find all the catalogue entries within a radius of each position
+
+        Parameters
+        ----------
+        ra, dec : array_like
+            Positions in degrees.
+        radius : float
+            Matching radius in arcsec.
+
+        Return
+        ------
+        matches : DataFrame
+            One row per pair with the columns idx (index of the position),
+            match (row in the catalogue) and sep (separation in arcsec),
+            sorted by idx and sep.
+        """
+        xyz = radec2xyz(ra, dec)
+        rows = np.where(np.isfinite(xyz).all(axis=1))[0]
+        other = cKDTree(xyz[rows])
+        pairs = other.sparse_distance_matrix(self.tree, arcsec2chord(radius),
+                                             output_type='ndarray')
+        matches = pd.DataFrame({'idx': rows[pairs['i']],
+                                'match': self.rows[pairs['j']],
+                                'sep': chord2arcsec(pairs['v'])})
+        # Identical positions have a distance of 0 and are left out of the
+        # sparse matrix
+        same = other.query_ball_tree(self.tree, r=0) if len(rows) and len(self.rows) else []
+        i = np.repeat(np.arange(len(same)), [len(s) for s in same])
+        if i.size:
+            j = np.concatenate([s for s in same if len(s)]).astype(int)
+            matches = pd.concat([matches,
+                                 pd.DataFrame({'idx': rows[i], 'match': self.rows[j],
+                                               'sep': np.zeros(i.size)})])
+        matches = matches.drop_duplicates(['idx', 'match'])
+        return matches.sort_values(['idx', 'sep']).reset_index(drop=True)
+
+
+    def nearest(self, ra, dec, radius=5.):
+        """
+        Closest catalogue entry within a radius of each position
+
+        Return
+        ------
+        match : ndarray
+            Row in the catalogue for each position, -1 if there is none.
+        sep : ndarray
+            Separation in arcsec, NaN if there is no match.
+        """
+        xyz = radec2xyz(ra, dec)
+        match = np.full(len(xyz), -1)
+        sep = np.full(len(xyz), np.nan)
+        rows = np.where(np.isfinite(xyz).all(axis=1))[0]
+        if not len(rows) or not len(self.rows):
+            return match, sep
+        d, j = self.tree.query(xyz[rows], distance_upper_bound=arcsec2chord(radius))
+        found = np.isfinite(d)
+        match[rows[found]] = self.rows[j[found]]
+        sep[rows[found]] = chord2arcsec(d[found])
+        return match, sep
+
+
+    def cone(self, ra, dec, radius=60.):
+        """
+        Catalogue entries within a radius (arcsec) of a single position,
+        without the overhead of match for one position
+
+        Return
+        ------
+        rows : ndarray
+            Rows in the catalogue, closest first.
+        sep : ndarray
+            Separations in arcsec.
+        """
+        xyz = radec2xyz(ra, dec)[0]
+        if not np.isfinite(xyz).all() or not len(self.rows):
+            return np.array([], dtype=int), np.array([])
+        j = np.array(self.tree.query_ball_point(xyz, arcsec2chord(radius)), dtype=int)
+        d = np.sqrt(((self.tree.data[j] - xyz)**2).sum(axis=1))
+        order = np.argsort(d, kind='mergesort')
+        return self.rows[j[order]], chord2arcsec(d[order])
+
+
+def crossmatch(ra1, dec1, ra2, dec2, radius=5.):
+    """
+    Match two catalogues in both directions in one pass
+
+    Parameters
+    ----------
+    ra1, dec1 : array_like
+        Positions in degrees of the first catalogue.
+    ra2, dec2 : array_like
+        Positions in degrees of the second catalogue.
+    radius : float
+        Matching radius in arcsec.
+
+    Return
+    ------
+    matches12 : DataFrame
+        Pairs with the columns idx1, idx2 and sep (arcsec), sorted by idx1.
+    matches21 : DataFrame
+        The same pairs sorted by idx2.
+    """
+    matches = SkyIndex(ra2, dec2).match(ra1, dec1, radius)
+    matches.columns = ['idx1', 'idx2', 'sep']
+    matches21 = matches.sort_values(['idx2', 'sep']).reset_index(drop=True)
+    return matches, matches21
+
+
+# The index of the catalogue in each worker process of matchChunks
+_INDEX = None
+
+
+def _initIndex(ra, dec):
+    global _INDEX
+    _INDEX = SkyIndex(ra, dec)
+
+
+def _matchChunk(args):
+    ra, dec, radius, offset = args
+    matches = _INDEX.match(ra, dec, radius)
+    matches['idx'] += offset
+    return matches
+
+
+def matchChunks(catra, catdec, ra, dec, radius=5., chunksize=50000, workers=None):
+    """
+    The same as SkyIndex(catra, catdec).match(ra, dec, radius), for many
+    positions. The positions are matched in chunks in worker processes, each
+    with its own index of the catalogue, so the memory used for the
+    positions is bounded by the chunk size.
+
+    Parameters
+    ----------
+    catra, catdec : array_like
+        The catalogue, in degrees.
+    ra, dec : array_like
+        Positions in degrees.
+    radius : float
+        Matching radius in arcsec.
+    chunksize : int
+        Number of positions in each chunk. With fewer positions than this
+        they are matched in this process.
+    workers : int
+        Number of processes (default is the number of CPUs).
+
+    Return
+    ------
+    matches : DataFrame
+        See SkyIndex.match.
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    if len(ra) <= chunksize or workers == 1:
+        return SkyIndex(catra, catdec).match(ra, dec, radius)
+    chunks = [(ra[s:s + chunksize], dec[s:s + chunksize], radius, s)
+              for s in range(0, len(ra), chunksize)]
+    with ProcessPoolExecutor(workers, initializer=_initIndex,
+                             initargs=(np.asarray(catra, dtype=float),
+                                       np.asarray(catdec, dtype=float))) as pool:
+        matches = list(pool.map(_matchChunk, chunks))
+    return pd.concat(matches, ignore_index=True)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+from http.client import IncompleteRead
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+import hashlib
+import json
+import os
+import zlib
+
+
+def _readState(fname):
+    """ Read the headers and hash saved from the last download """
+    try:
+        with open(fname + '.json') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _writeState(fname, state):
+    with open(fname + '.json', 'w') as f:
+        json.dump(state, f, indent=1)
+
+
+def download(url, fname, chunksize=65536, timeout=60):
+    """
+    Download a file only if it changed since the last download.
+
+    The ETag and Last-Modified headers of the last download are sent back
+    as If-None-Match/If-Modified-Since, the body is streamed to disk in
+    chunks (and decompressed if it is gzipped) and the file is only
+    replaced if the SHA-256 of the content changed. The headers and hash
+    are kept next to the file, in fname + '.json'. If the download fails
+    the file is left as it was.
+
+    Parameters
+    ----------
+    url : str
+        The url to download.
+    fname : str
+        The file to save the content to.
+    chunksize : int
+        Size in bytes of the chunks read from the connection.
+    timeout : float
+        Timeout in seconds for the connection.
+
+    Returns
+    -------
+    changed : bool
+        True if the content of fname changed.
+    """
+    state = _readState(fname) if os.path.isfile(fname) else {}
+    headers = {'Accept-Encoding': 'gzip'}
+    if state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state.get('last_modified'):
+        headers['If-Modified-Since'] = state['last_modified']
+    try:
+        response = urlopen(Request(url, headers=headers), timeout=timeout)
+    except HTTPError as e:
+        if e.code == 304:
+            return False
+        raise
+    gzipped = response.headers.get('Content-Encoding', '').lower() == 'gzip'
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    sha = hashlib.sha256()
+    tmp = fname + '.part'
+    try:
+        with open(tmp, 'wb') as f:
+            while True:
+                chunk = response.read(chunksize)
+                if not chunk:
+                    break
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                sha.update(chunk)
+                f.write(chunk)
+            # The connection was closed before the end of the body
+            if getattr(response, 'length', None):
+                raise IncompleteRead(b'', response.length)
+            if decompressor:
+                if not decompressor.eof:
+                    raise IOError('Truncated gzip body from %s' % url)
+                chunk = decompressor.flush()
+                sha.update(chunk)
+                f.write(chunk)
+    except Exception:
+        # The last complete download is kept
+        os.remove(tmp)
+        raise
+    finally:
+        response.close()
+    changed = sha.hexdigest() != state.get('sha256')
+    if changed:
+        os.replace(tmp, fname)
+    else:
+        os.remove(tmp)
+    _writeState(fname, {'url': url,
+                        'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                        'sha256': sha.hexdigest()})
+    return changed
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import os
+import pandas as pd
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def _columnar(fname):
+    """ Name of the Parquet file stored next to a csv file """
+    return os.path.splitext(fname)[0] + '.parquet'
+
+
+def writeTable(df, fname):
+    """
+    Save a table from exoplanet.eu as csv and, if pyarrow is installed,
+    as a typed columnar Parquet file next to it (exo.csv -> exo.parquet).
+
+    Parameters
+    ----------
+    df : DataFrame
+        The table to save.
+    fname : str
+        Name of the csv file.
+    """
+    df.to_csv(fname, index=False)
+    if pyarrow is None:
+        return
+    # Text columns can mix str and bytes after the VOTable conversion
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].map(lambda x: x.decode('utf8') if isinstance(x, bytes) else x)
+    try:
+        df.to_parquet(_columnar(fname), index=False)
+    except (pyarrow.ArrowException, ValueError, TypeError):
+        # Fall back to the csv file only
+        if os.path.isfile(_columnar(fname)):
+            os.remove(_columnar(fname))
+
+
+def readTable(fname, columns=None):
+    """
+    Read a table from exoplanet.eu, only with the columns needed.
+    The Parquet file is used if it is at least as new as the csv file.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the csv file, e.g. exo.csv (confirmed planets) or
+        exo_cont.csv (unconfirmed and candidates).
+    columns : list
+        Columns to read. All are read by default.
+
+    Returns
+    -------
+    df : DataFrame
+        The table.
+    """
+    parquet = _columnar(fname)
+    if pyarrow is not None and os.path.isfile(parquet) and \
+            (not os.path.isfile(fname) or os.path.getmtime(parquet) >= os.path.getmtime(fname)):
+        return pd.read_parquet(parquet, columns=columns)
+    return pd.read_csv(fname, skipinitialspace=True, usecols=columns)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import argparse
+import os
+import threading
+import numpy as np
+
+
+class ExtinctionGrid:
+    """
+    Extinction (Schlafly & Finkbeiner 2011 mean and std, as given by IRSA)
+    on a regular grid in RA and DEC, saved as a compact .npz file.
+    Cells that are not filled yet are NaN.
+    """
+    def __init__(self, fname='extinction.npz', step=1.):
+        self.fname = fname
+        self.lock = threading.Lock()
+        if os.path.isfile(fname):
+            data = np.load(fname)
+            self.step = float(data['step'])
+            self.mean = data['mean']
+            self.std = data['std']
+        else:
+            self.step = step
+            shape = (int(round(180./step)) + 1, int(round(360./step)))
+            self.mean = np.full(shape, np.nan, dtype=np.float32)
+            self.std = np.full(shape, np.nan, dtype=np.float32)
+
+
+    def cells(self, ra, dec):
+        """ Indices (row, column) of the nearest cell to each position in degrees """
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+        i = np.clip(np.round((dec + 90.)/self.step).astype(int), 0, self.mean.shape[0]-1)
+        j = np.round((ra % 360.)/self.step).astype(int) % self.mean.shape[1]
+        return i, j
+
+
+    def lookup(self, ra, dec):
+        """
+        Extinction at positions in degrees, from the nearest cell centre
+        (no interpolation)
+
+        Returns
+        -------
+        Av, Averr : ndarrays
+            Mean and std of the extinction. NaN for cells not filled yet.
+        """
+        i, j = self.cells(ra, dec)
+        return self.mean[i, j].astype(float), self.std[i, j].astype(float)
+
+
+    def centres(self, ra=None, dec=None):
+        """ RA and DEC of the centre of the cells of some positions (all by default) """
+        if ra is None:
+            i, j = np.indices(self.mean.shape).reshape(2, -1)
+        else:
+            i, j = self.cells(ra, dec)
+        return j*self.step, i*self.step - 90.
+
+
+    def fill(self, ra, dec, query, overwrite=False):
+        """
+        Fill the cells of some positions with a query to a service
+
+        Parameters
+        ----------
+        ra, dec : array_like
+            Positions in degrees.
+        query : function
+            Called as query(ra, dec) with the centre of a cell in degrees,
+            returns the mean and std of the extinction there.
+        overwrite : bool
+            Query again the cells already filled.
+
+        Returns
+        -------
+        n : int
+            Number of cells filled.
+        """
+        i, j = self.cells(ra, dec)
+        cells = sorted(set(zip(i, j)))
+        n = 0
+        for i, j in cells:
+            if not overwrite and not np.isnan(self.mean[i, j]):
+                continue
+            mean, std = query(j*self.step, i*self.step - 90.)
+            with self.lock:
+                self.mean[i, j], self.std[i, j] = mean, std
+            n += 1
+        return n
+
+
+    def save(self):
+        with self.lock:
+            np.savez_compressed(self.fname, step=self.step, mean=self.mean,
+                                std=self.std)
+
+
+def irsaQuery(ra, dec):
+    """ Mean and std of the extinction from IRSA around a position in degrees """
+    from astropy import coordinates as coord
+    from astropy import units as u
+    from astroquery.irsa_dust import IrsaDust
+    pos = coord.SkyCoord(ra=ra, dec=dec, unit=(u.deg, u.deg), frame='icrs')
+    #AvSF = Schlafly & Finkbeiner 2011 (ApJ 737, 103)
+    tableAv = IrsaDust.get_query_table(pos, radius='02d', section='ebv', timeout=60)
+    return tableAv['ext SandF mean'].data[0], tableAv['ext SandF std'].data[0]
+
+
+def _parse():
+    """ Fill the extinction grid """
+    p = argparse.ArgumentParser(description='Fill the local extinction grid from IRSA')
+    p.add_argument('-g', '--grid', help='The grid file', default='extinction.npz')
+    p.add_argument('-s', '--step', help='Step of a new grid [deg]', type=float, default=1.)
+    p.add_argument('-a', '--all', help='Fill the whole sky instead of the cells '
+                   'of the stars in SWEET-Cat', default=False, action='store_true')
+    p.add_argument('-i', '--input', help='SWEET-Cat rdb file', default='WEBSITE_online.rdb')
+    return p.parse_args()
+
+
+def main():
+    args = _parse()
+    grid = ExtinctionGrid(args.grid, step=args.step)
+    if args.all:
+        ra, dec = grid.centres()
+    else:
+        from catalogue import readRDB
+        SC = readRDB(args.input)
+        ra, dec = SC.radeg.values, SC.decdeg.values
+    try:
+        n = grid.fill(ra, dec, irsaQuery)
+    finally:
+        grid.save()
+    print('%d cells filled. Saved in %s' % (n, args.grid))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# Gaia DR2 epoch relative to J2000 (years)
+GAIA_DELTAT = -15.5
+# Columns of the local catalogue, and their names in Vizier and in the
+# Gaia archive
+COLUMNS = {'ra': ('RA_ICRS', 'ra'), 'dec': ('DE_ICRS', 'dec'),
+           'pmra': ('pmRA', 'pmra'), 'pmdec': ('pmDE', 'pmdec'),
+           'plx': ('Plx', 'parallax'), 'e_plx': ('e_Plx', 'parallax_error'),
+           'source': ('Source', 'source_id')}
+
+
+def gaiaMatch(ra, dec, table, maxsep=1.5):
+    """
+    Find the Gaia source of each target. The Gaia positions are moved back
+    to J2000 with their proper motions, all at once.
+
+    Parameters
+    ----------
+    ra, dec : array_like
+        Positions of the targets in degrees (J2000).
+    table : Table or DataFrame
+        Gaia sources with the columns RA_ICRS, DE_ICRS, pmRA, pmDE, Plx,
+        e_Plx and Source, and _q (the target of each source, starting at 1)
+        if there is more than one target.
+    maxsep : float
+        Maximum separation in arcsec.
+
+    Returns
+    -------
+    plx : DataFrame
+        One row per target with the columns plx, e_plx, sep (arcsec) and
+        source. NaN if there is no source closer than maxsep or if its
+        parallax is not positive.
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    plx = pd.DataFrame({'plx': np.nan, 'e_plx': np.nan, 'sep': np.nan,
+                        'source': None}, index=range(len(ra)))
+    if table is None or len(table) == 0:
+        return plx
+    column = lambda name: np.ma.filled(np.ma.asarray(table[name], dtype=float), np.nan)
+    q = column('_q').astype(int) - 1 if '_q' in table.columns else np.zeros(len(table), int)
+    #Moving the positions to 2000
+    pmra = np.nan_to_num(column('pmRA'))
+    pmde = np.nan_to_num(column('pmDE'))
+    deold = column('DE_ICRS') + pmde*GAIA_DELTAT/3600000.
+    raold = column('RA_ICRS') + pmra*GAIA_DELTAT/3600000./np.cos(np.radians(deold))
+    r1, d1, r2, d2 = map(np.radians, (ra[q], dec[q], raold, deold))
+    sep = np.degrees(2*np.arcsin(np.sqrt(np.sin((d2-d1)/2)**2 +
+                                         np.cos(d1)*np.cos(d2)*np.sin((r2-r1)/2)**2)))*3600.
+    sources = pd.DataFrame({'q': q, 'sep': sep, 'plx': column('Plx'),
+                            'e_plx': column('e_Plx'),
+                            'source': np.asarray(table['Source'], dtype=np.int64)})
+    best = sources.loc[sources.groupby('q')['sep'].idxmin()].set_index('q')
+    best = best[(best.sep < maxsep) & (best.plx > 0)]
+    plx.loc[best.index, ['plx', 'e_plx', 'sep']] = best[['plx', 'e_plx', 'sep']]
+    plx.loc[best.index, 'source'] = best.source.astype(object)
+    return plx
+
+
+def build(table, outdir='gaia_local', zone=1.):
+    """
+    Build the local catalogue from a subset of Gaia
+
+    The sources are sorted by declination zone and by RA inside each zone,
+    and every column is saved as a .npy file so it can be memory mapped.
+
+    Parameters
+    ----------
+    table : Table or DataFrame
+        Gaia sources, with the column names from Vizier (RA_ICRS, DE_ICRS,
+        pmRA, pmDE, Plx, e_Plx, Source) or from the Gaia archive (ra, dec,
+        pmra, pmdec, parallax, parallax_error, source_id).
+    outdir : str
+        Directory of the local catalogue.
+    zone : float
+        Height of the declination zones in degrees.
+    """
+    data = {}
+    for name, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in table.columns:
+                data[name] = np.ma.filled(np.ma.asarray(table[alias]),
+                                          0 if name == 'source' else np.nan)
+                break
+        else:
+            raise KeyError('Column %s (or %s) not found' % aliases)
+    data['source'] = data['source'].astype(np.int64)
+    nzones = int(np.ceil(180./zone))
+    z = np.clip(((data['dec'].astype(float) + 90.)//zone).astype(int), 0, nzones-1)
+    # The sorting key: zone first, RA inside the zone
+    key = z*360. + data['ra'].astype(float)
+    order = np.argsort(key, kind='mergesort')
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    np.save(os.path.join(outdir, 'key.npy'), key[order])
+    for name in COLUMNS:
+        dtype = np.int64 if name == 'source' else np.float64
+        np.save(os.path.join(outdir, name + '.npy'), data[name][order].astype(dtype))
+    with open(os.path.join(outdir, 'meta.json'), 'w') as f:
+        json.dump({'zone': zone, 'nzones': nzones, 'size': len(order)}, f)
+
+
+class GaiaLocal:
+    """ A local catalogue made with build, memory mapped from disk """
+    def __init__(self, outdir='gaia_local'):
+        with open(os.path.join(outdir, 'meta.json')) as f:
+            meta = json.load(f)
+        self.zone = meta['zone']
+        self.nzones = meta['nzones']
+        self.key = np.load(os.path.join(outdir, 'key.npy'), mmap_mode='r')
+        self.columns = dict((name, np.load(os.path.join(outdir, name + '.npy'), mmap_mode='r'))
+                            for name in COLUMNS)
+
+
+    def query(self, ra, dec, radius=10.):
+        """
+        All the sources within a radius of each target
+
+        Parameters
+        ----------
+        ra, dec : array_like
+            Positions of the targets in degrees.
+        radius : float
+            Search radius in arcsec.
+
+        Returns
+        -------
+        table : DataFrame
+            The sources with the Vizier column names, and _q, the target of
+            each source (starting at 1). Sources near a target can be
+            slightly further than the radius.
+        """
+        ra = np.atleast_1d(np.asarray(ra, dtype=float)) % 360.
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+        r = radius/3600.
+        # The declination zones of each target
+        zlo = np.clip(((dec - r + 90.)//self.zone).astype(int), 0, self.nzones-1)
+        zhi = np.clip(((dec + r + 90.)//self.zone).astype(int), 0, self.nzones-1)
+        n = zhi - zlo + 1
+        t = np.repeat(np.arange(len(ra)), n)
+        z = zlo[t] + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        # The RA range, split in two where it wraps around 0/360
+        dra = np.minimum(r/np.maximum(np.cos(np.radians(np.abs(dec) + r)), 1e-9), 180.)[t]
+        lo, hi = ra[t] - dra, ra[t] + dra
+        low, high = lo < 0, hi >= 360.
+        t = np.concatenate([t, t[low], t[high]])
+        z = np.concatenate([z, z[low], z[high]])
+        lo, hi = (np.concatenate([np.maximum(lo, 0), lo[low] + 360., np.zeros(high.sum())]),
+                  np.concatenate([np.minimum(hi, 360.), np.full(low.sum(), 360.), hi[high] - 360.]))
+        start = np.searchsorted(self.key, z*360. + lo, side='left')
+        end = np.searchsorted(self.key, z*360. + hi, side='right')
+        count = np.maximum(end - start, 0)
+        rows = np.repeat(start - np.cumsum(count) + count, count) + np.arange(count.sum())
+        table = pd.DataFrame({'RA_ICRS': self.columns['ra'][rows],
+                              'DE_ICRS': self.columns['dec'][rows],
+                              'pmRA': self.columns['pmra'][rows],
+                              'pmDE': self.columns['pmdec'][rows],
+                              'Plx': self.columns['plx'][rows],
+                              'e_Plx': self.columns['e_plx'][rows],
+                              'Source': self.columns['source'][rows],
+                              '_q': np.repeat(t, count) + 1})
+        return table
+
+
+    def match(self, ra, dec, radius=10., maxsep=1.5):
+        """
+        Gaia parallaxes of the targets, see gaiaMatch
+
+        Parameters
+        ----------
+        ra, dec : array_like
+            Positions of the targets in degrees (J2000).
+        radius : float
+            Search radius in arcsec around each target.
+        maxsep : float
+            Maximum separation in arcsec at J2000.
+        """
+        return gaiaMatch(ra, dec, self.query(ra, dec, radius), maxsep=maxsep)
+
+
+def updateParallaxes(SC, gaia, maxsep=1.5):
+    """
+    Replace the parallaxes of a SWEET-Cat table with the ones from a
+    local Gaia catalogue, for the stars with a match
+
+    Parameters
+    ----------
+    SC : DataFrame
+        The SWEET-Cat table (see catalogue.readRDB).
+    gaia : GaiaLocal
+        The local Gaia catalogue.
+
+    Returns
+    -------
+    SC : DataFrame
+        The table with new p, perr and pflag.
+    nmatch : int
+        The number of stars with a new parallax.
+    """
+    plx = gaia.match(SC.radeg.values, SC.decdeg.values, maxsep=maxsep)
+    found = ~np.isnan(plx.plx.values)
+    SC = SC.copy()
+    SC.loc[found, 'p'] = plx.plx.values[found].round(2)
+    SC.loc[found, 'perr'] = plx.e_plx.values[found].round(2)
+    pflag = SC.pflag.astype(object)
+    pflag[found] = 'GAIADR2'
+    SC['pflag'] = pflag.astype('category')
+    return SC, int(found.sum())
+
+
+def _parse():
+    """ Build and use a local Gaia catalogue """
+    p = argparse.ArgumentParser(description='Local Gaia catalogue for parallaxes')
+    sub = p.add_subparsers(dest='command')
+    b = sub.add_parser('build', help='Build the local catalogue from a Gaia subset')
+    b.add_argument('table', help='csv or FITS file with the Gaia sources')
+    b.add_argument('-z', '--zone', help='Height of the declination zones [deg]',
+                   type=float, default=1.)
+    u_ = sub.add_parser('update', help='New parallaxes for a SWEET-Cat rdb file')
+    u_.add_argument('input', help='rdb file', nargs='?', default='WEBSITE_online.rdb')
+    u_.add_argument('-o', '--output', help='New rdb file', default='WEBSITE_online_gaia.rdb')
+    p.add_argument('-d', '--directory', help='Directory of the local catalogue',
+                   default='gaia_local')
+    return p.parse_args()
+
+
+def main():
+    args = _parse()
+    if args.command == 'build':
+        if args.table.endswith('.csv'):
+            table = pd.read_csv(args.table)
+        else:
+            from astropy.table import Table
+            table = Table.read(args.table)
+        build(table, args.directory, zone=args.zone)
+        print('Saved %d sources in %s' % (len(table), args.directory))
+    elif args.command == 'update':
+        from catalogue import readRDB, writeRDB
+        SC, nmatch = updateParallaxes(readRDB(args.input), GaiaLocal(args.directory))
+        writeRDB(SC, args.output)
+        print('%d parallaxes from Gaia. Saved in %s' % (nmatch, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import numpy as np
+
+
+METHODS = ('mc', 'adaptive', 'linear')
+# Default memory budget in bytes for the samples drawn at once. The arrays
+# of a chunk stay in the CPU cache, which is faster than larger chunks
+MEMORY = 2e6
+
+
+def _chunksize(ntrials, memory, narrays):
+    """ Number of stars with ntrials samples of narrays arrays in the memory budget """
+    return max(1, int(memory // (8 * ntrials * narrays)))
+
+
+class _Moments:
+    """
+    Running sums of the first four powers of the samples of each star,
+    relative to a reference value (the function at the central values) to
+    keep the sums accurate.
+    """
+    def __init__(self, reference):
+        self.reference = reference
+        self.n = np.zeros(reference.size)
+        self.sums = np.zeros((4, reference.size))
+
+    def add(self, i, samples):
+        d = samples - self.reference[i, None]
+        self.n[i] += samples.shape[1]
+        d2 = d*d
+        self.sums[0, i] += d.sum(axis=1)
+        self.sums[1, i] += d2.sum(axis=1)
+        self.sums[2, i] += (d2*d).sum(axis=1)
+        self.sums[3, i] += (d2*d2).sum(axis=1)
+
+    def estimates(self, i):
+        """ Mean, standard deviation and their standard errors """
+        n = self.n[i]
+        s1, s2, s3, s4 = self.sums[:, i]
+        m = s1 / n
+        var = (s2 - n*m*m) / (n - 1)
+        # Central fourth moment, for the error on the variance
+        m4 = (s4 - 4*m*s3 + 6*m*m*s2) / n - 3*m**4
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sevar = np.sqrt(np.maximum(m4 - var*var*(n - 3)/(n - 1), 0) / n)
+            sig = np.sqrt(var)
+            return self.reference[i] + m, sig, sig / np.sqrt(n), sevar / (2*sig)
+
+
+def propagate(func, means, sigmas, method='mc', ntrials=10000, rtol=0.01,
+              block=1000, maxtrials=100000, memory=MEMORY, seed=None, scatter=0.):
+    """
+    Propagate the uncertainties of the parameters of many stars through a
+    function, assuming independent Gaussian errors.
+
+    Parameters
+    ----------
+    func : callable
+        Function of the parameters, working on arrays of any shape.
+    means, sigmas : list of ndarrays
+        The values and uncertainties of each parameter, one element per
+        star. Stars with an undefined (NaN) uncertainty get the function of
+        the values and a NaN uncertainty.
+    method : str
+        mc: ntrials Monte Carlo samples per star.
+        adaptive: Monte Carlo samples are drawn in blocks until the standard
+        errors of the mean and of the total uncertainty (see scatter) are
+        below rtol times the total uncertainty (and, for the mean, times the
+        absolute value of the mean if larger) or maxtrials is reached.
+        Stars whose uncertainty is small compared to scatter stop early.
+        linear: first order propagation with numerical derivatives, the
+        value is the function of the central values.
+    ntrials : int
+        Number of samples per star for mc.
+    rtol : float
+        Relative precision for adaptive.
+    block, maxtrials : int
+        Samples per block and maximum number of samples per star for adaptive.
+    memory : float
+        Memory budget in bytes for the samples drawn at once.
+    seed : int, RandomState or None
+        Seed for the random number generator, or the generator.
+    scatter : float or ndarray
+        Uncertainty the caller adds quadratically to sigma, e.g. the
+        intrinsic scatter of a calibration. It is not included in sigma,
+        only used to judge the convergence of adaptive.
+
+    Returns
+    -------
+    mean, sigma : ndarrays
+        The mean and standard deviation of the function for each star.
+    nsamples : ndarray
+        The number of samples used for each star (0 for linear).
+    """
+    if method not in METHODS:
+        raise ValueError('Unknown method %s, use one of %s' % (method, ', '.join(METHODS)))
+    arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                   for x in list(means) + list(sigmas)])
+    npar = len(arrays) // 2
+    means, sigmas = arrays[:npar], arrays[npar:]
+    central = func(*means)
+    mean = np.array(central, dtype=float)
+    sigma = np.full(mean.size, np.nan)
+    nsamples = np.zeros(mean.size, dtype=int)
+    idx = np.where(np.isfinite(sum(sigmas)))[0]
+    if method == 'linear':
+        var = np.zeros(idx.size)
+        for j in range(npar):
+            # Central differences, with a step of a thousandth of the error
+            h = 1e-3 * sigmas[j][idx]
+            h = np.where(h > 0, h, 1.)
+            up = [x[idx] for x in means]
+            down = [x[idx] for x in means]
+            up[j] = up[j] + h
+            down[j] = down[j] - h
+            var += ((func(*up) - func(*down)) / (2*h) * sigmas[j][idx])**2
+        sigma[idx] = np.sqrt(var)
+        return mean, sigma, nsamples
+    rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+    moments = _Moments(mean)
+    scatter = np.broadcast_to(np.asarray(scatter, dtype=float), mean.shape)
+    ndraw = ntrials if method == 'mc' else min(block, maxtrials)
+    active = idx
+    while active.size:
+        step = _chunksize(ndraw, memory, npar + 2)
+        for start in range(0, active.size, step):
+            i = active[start:start + step]
+            samples = func(*[m[i, None] + s[i, None]*rng.randn(i.size, ndraw)
+                             for m, s in zip(means, sigmas)])
+            moments.add(i, samples)
+        if method == 'mc':
+            break
+        m, s, sem, ses = moments.estimates(active)
+        # The error on the total uncertainty, sqrt(s**2 + scatter**2)
+        total = np.sqrt(s*s + scatter[active]**2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            converged = (sem <= rtol*np.maximum(np.abs(m), total)) \
+                & (ses*s/total <= rtol*total)
+        # Nothing to gain from more samples
+        converged |= (s == 0) | ~np.isfinite(m)
+        active = active[~converged & (moments.n[active] < maxtrials)]
+        ndraw = min(block, int(maxtrials - moments.n[active].min())) if active.size else 0
+    if idx.size:
+        mean[idx], sigma[idx] = moments.estimates(idx)[:2]
+        nsamples[idx] = moments.n[idx]
+    return mean, sigma, nsamples
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import re
+import numpy as np
+import pandas as pd
+
+
+_SEPARATORS = re.compile(r'[\s-]')
+
+
+def normalize(names):
+    """
+    Normalize star names: lower case, without spaces and dashes
+
+    Parameters
+    ----------
+    names : list or Series
+        Star names.
+
+    Returns
+    -------
+    names : Series
+        The normalized names.
+    """
+    names = pd.Series(names, dtype=object).fillna('').astype(str)
+    return names.str.lower().str.replace(_SEPARATORS.pattern, '', regex=True)
+
+
+def strip_planet(names):
+    """
+    Remove the trailing b, c, d, etc (or .01, .02 and .2) from planet names
+    to get the stellar name
+
+    Parameters
+    ----------
+    names : list or Series
+        Planet names.
+
+    Returns
+    -------
+    names : Series
+        The stellar names, without leading and trailing whitespaces.
+    """
+    names = pd.Series(names, dtype=object).fillna('').astype(str)
+    names = names.str.strip()
+    return names.str.replace(r'( [b-jB]|\.0[12]|\.2)$', '', regex=True).str.strip()
+
+
+def simbad_ids(ids):
+    """ Split the IDS field from Simbad ('HD 1|GJ 2|...') in single names """
+    return [i.strip() for i in str(ids).split('|') if i.strip()]
+
+
+class NameIndex:
+    """
+    Hash index from normalized star names (and their aliases) to rows
+    of a catalogue
+    """
+    def __init__(self, names=None):
+        self.index = {}
+        self.keys = {}
+        if names is not None:
+            self.add_names(names)
+
+
+    @classmethod
+    def from_catalogue(cls, SC):
+        """
+        Index the SWEET-Cat table (as read in checkExoplanet.Update.readSC)
+        with its name, HD number and alternative name
+        """
+        index = cls(SC['name'])
+        hd = pd.Series(SC['hd'].values, dtype=object).fillna('NULL').astype(str)
+        # HD numbers read as floats
+        hd = hd.str.strip().str.replace(r'\.0$', '', regex=True)
+        rows = np.where((hd != 'NULL') & (hd != ''))[0]
+        index.add_names('HD' + hd.values[rows], rows)
+        alt = pd.Series(SC['n3'].values, dtype=object).fillna('NULL').astype(str).str.strip()
+        rows = np.where((alt != 'NULL') & (alt != ''))[0]
+        index.add_names(alt.values[rows], rows)
+        return index
+
+
+    def add_names(self, names, rows=None):
+        """
+        Add names to the index. The rows default to the position of each
+        name. The first row seen for a name is kept.
+        """
+        keys = normalize(names)
+        if rows is None:
+            rows = range(len(keys))
+        for key, row in zip(keys.values, rows):
+            self._add(key, int(row))
+
+
+    def add_ids(self, row, ids):
+        """
+        Add the Simbad aliases (HD, GJ, HIP, WASP, KOI, ...) of a row
+
+        Parameters
+        ----------
+        row : int
+            Row in the catalogue.
+        ids : str
+            The IDS field from Simbad, with the names separated by '|'.
+        """
+        names = simbad_ids(ids)
+        self.add_names(names, [row]*len(names))
+
+
+    def _add(self, key, row):
+        if not key:
+            return
+        if key not in self.index:
+            self.index[key] = row
+        keys = self.keys.setdefault(row, [])
+        if key not in keys:
+            keys.append(key)
+
+
+    def get(self, name, default=-1):
+        """ Row of a name, or default if it is not in the index """
+        # The same as normalize, without a Series for a single name
+        key = _SEPARATORS.sub('', '' if pd.isnull(name) else str(name).lower())
+        return self.index.get(key, default)
+
+
+    def aliases(self, row):
+        """ All the normalized names of a row """
+        return self.keys.get(row, [])
+
+
+    def __contains__(self, name):
+        return self.get(name) != -1
+
+
+    def __len__(self):
+        return len(self.index)
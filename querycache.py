@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import pickle
+import sqlite3
+import threading
+import time
+
+
+DAY = 86400.
+# Time to live (in seconds) of the results of each service
+TTL = {'simbad': 30*DAY, 'gaia': 365*DAY, 'dust': 10*365*DAY}
+
+
+class QueryCache:
+    """
+    Persistent cache (SQLite) of the results of remote queries, keyed by
+    service, rounded coordinates and radius. Results expire after the time
+    to live of their service and the least recently used ones are evicted
+    when the cache grows larger than maxsize bytes.
+    """
+    def __init__(self, fname='querycache.sqlite', ttl=None, maxsize=100e6,
+                 precision=5):
+        self.fname = fname
+        self.ttl = dict(TTL, **(ttl or {}))
+        self.maxsize = maxsize
+        self.precision = precision
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(fname, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, '
+                        'service TEXT, value BLOB, size INTEGER, created REAL, '
+                        'accessed REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS accessed ON cache (accessed)')
+        self.db.commit()
+
+
+    def key(self, service, ra, dec, radius=None):
+        """ Key of a query. Coordinates in degrees are rounded """
+        def fmt(x):
+            if isinstance(x, str):
+                return x.strip()
+            return '%.*f' % (self.precision, x)
+        return '|'.join([service, fmt(ra), fmt(dec), str(radius)])
+
+
+    def get(self, service, ra, dec, radius=None):
+        """
+        Look up a query in the cache
+
+        Returns
+        -------
+        hit : bool
+            True if a result that has not expired was found.
+        value : object
+            The result, None if it was not found.
+        """
+        key = self.key(service, ra, dec, radius)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT value, created FROM cache WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl.get(service, float('inf')):
+                self.misses[service] = self.misses.get(service, 0) + 1
+                return False, None
+            self.db.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+            self.db.commit()
+            self.hits[service] = self.hits.get(service, 0) + 1
+        return True, pickle.loads(row[0])
+
+
+    def put(self, service, ra, dec, value, radius=None):
+        """ Save the result of a query """
+        key = self.key(service, ra, dec, radius)
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, service, sqlite3.Binary(blob), len(blob), now, now))
+            self._evict()
+            self.db.commit()
+
+
+    def _evict(self):
+        """ Remove the least recently used results until the cache fits in maxsize """
+        size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if size <= self.maxsize:
+            return
+        rows = self.db.execute('SELECT key, size FROM cache ORDER BY accessed').fetchall()
+        old = []
+        for key, s in rows:
+            if size <= self.maxsize:
+                break
+            old.append((key,))
+            size -= s
+        self.db.executemany('DELETE FROM cache WHERE key = ?', old)
+
+
+    def cached(self, service, func, radius=None):
+        """
+        Wrap a query function func(ra, dec) so its results are cached.
+        Queries that raise an exception are not cached.
+        """
+        def wrapper(ra, dec):
+            hit, value = self.get(service, ra, dec, radius)
+            if not hit:
+                value = func(ra, dec)
+                self.put(service, ra, dec, value, radius)
+            return value
+        return wrapper
+
+
+    def summary(self):
+        """ Hits and misses of each service """
+        services = sorted(set(self.hits) | set(self.misses))
+        return ', '.join('%s: %d hits, %d misses' % (s, self.hits.get(s, 0),
+                                                    self.misses.get(s, 0))
+                         for s in services)
+
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+# Derive the mass, radius, logg and spectroscopic parallax again for all the
+# stars in SWEET-Cat, e.g. after a change in a calibration. Example:
+#
+#   python recompute.py WEBSITE_online.rdb -o WEBSITE_recomputed.rdb -d diff.csv
+#
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+import pandas as pd
+from catalogue import readRDB, writeRDB
+from extinction import ExtinctionGrid
+from logg import logg as loggMR
+from ParallaxSpec import parallax
+from TorresMass import massTorresBatch, radTorresBatch
+
+
+# The columns given to each worker
+INPUT = ['Teff', 'Tefferr', 'logg', 'logger', 'feh', 'feherr', 'V', 'Verr',
+         'Av', 'Averr']
+
+
+def derive(chunk, method='mc', seed=None):
+    """
+    Mass, radius, logg and spectroscopic parallax of a chunk of stars
+
+    Parameters
+    ----------
+    chunk : DataFrame
+        The columns in INPUT.
+    method : str
+        mc, adaptive or linear, see montecarlo.propagate.
+    seed : int or None
+        Seed for the random number generators. The mass, the radius and the
+        parallax each get their own independent stream from it.
+
+    Returns
+    -------
+    df : DataFrame
+        M, Merr (Torres with the Santos correction), R, Rerr (Torres), the
+        logg from M and R (loggMR, loggMRerr) and the spectroscopic
+        parallax (pspec, pspecerr), with the index of chunk.
+    """
+    c = dict((column, chunk[column].values.astype(float)) for column in INPUT)
+    if seed is None:
+        seeds = [None]*3
+    else:
+        seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(3)]
+    # Stars with missing or invalid parameters get NaN
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        M, Merr = massTorresBatch(c['Teff'], c['Tefferr'], c['logg'], c['logger'],
+                                  c['feh'], c['feherr'], method=method, seed=seeds[0])
+        R, Rerr = radTorresBatch(c['Teff'], c['Tefferr'], c['logg'], c['logger'],
+                                 c['feh'], c['feherr'], method=method, seed=seeds[1])
+        g = loggMR(M.copy(), R.copy())
+        # First order, the relative errors of M and R are small
+        gerr = np.sqrt((Merr/M)**2 + (2*Rerr/R)**2) / np.log(10)
+        p, perr = parallax(c['Teff'], c['Tefferr'], c['logg'], c['logger'], c['V'],
+                           c['Verr'], M, Merr, c['Av'], c['Averr'], method=method,
+                           seed=seeds[2])
+    return pd.DataFrame({'M': M, 'Merr': Merr, 'R': R, 'Rerr': Rerr,
+                         'loggMR': g, 'loggMRerr': gerr,
+                         'pspec': p, 'pspecerr': perr}, index=chunk.index)
+
+
+def _chunk(args):
+    return derive(*args)
+
+
+def extinction(SC, grid='extinction.npz'):
+    """ Av and its error of each star from the local grid (0 without it) """
+    if not os.path.isfile(grid):
+        return np.zeros(len(SC)), np.zeros(len(SC))
+    Av, Averr = ExtinctionGrid(grid).lookup(SC.radeg.values, SC.decdeg.values)
+    return np.nan_to_num(Av), np.nan_to_num(Averr)
+
+
+def recompute(SC, workers=None, method='mc', seed=None, grid='extinction.npz'):
+    """
+    Derive the parameters of all the stars, in parallel processes
+
+    Parameters
+    ----------
+    SC : DataFrame
+        The catalogue, see catalogue.readRDB.
+    workers : int
+        Number of processes (default is the number of CPUs).
+    method : str
+        mc, adaptive or linear, see montecarlo.propagate.
+    seed : int or None
+        Seed for the random number generator. Each chunk of stars gets
+        seed plus the number of the chunk.
+    grid : str
+        The extinction grid for the parallaxes, see extinction.py.
+
+    Returns
+    -------
+    derived : DataFrame
+        The result of derive for all the stars, with the index of SC.
+    """
+    workers = workers or os.cpu_count() or 1
+    stars = SC.loc[:, [column for column in INPUT if column in SC]]
+    stars['Av'], stars['Averr'] = extinction(SC, grid)
+    # A few chunks per process to keep them all busy until the end
+    chunks = [stars.iloc[i] for i in np.array_split(np.arange(len(stars)), 4*workers)
+              if len(i)]
+    seeds = [None if seed is None else seed + i for i in range(len(chunks))]
+    with ProcessPoolExecutor(workers) as pool:
+        derived = list(pool.map(_chunk, [(chunk, method, s) for chunk, s in
+                                          zip(chunks, seeds)]))
+    return pd.concat(derived)
+
+
+def update(SC, derived):
+    """
+    The catalogue with the new masses, and the new parallaxes of the stars
+    with a spectroscopic parallax (pflag Spec)
+    """
+    new = SC.copy()
+    # Stars without the parameters for the calibration keep their mass
+    mass = derived.M.notnull().values
+    new.loc[mass, 'M'] = derived.M[mass].round(2)
+    new.loc[mass, 'Merr'] = derived.Merr[mass].round(2)
+    spec = (new.pflag == 'Spec').values & derived.pspec.notnull().values
+    new.loc[spec, 'p'] = derived.pspec[spec].round(2)
+    new.loc[spec, 'perr'] = derived.pspecerr[spec].round(2)
+    return new
+
+
+def diff(SC, new, derived):
+    """
+    The values that moved by more than their errors (added quadratically),
+    and the stars with a spectroscopic logg inconsistent with the logg from
+    the mass and radius. One row per star and quantity.
+    """
+    pairs = [(column, SC[column], SC[error], new[column], new[error])
+             for column, error in (('M', 'Merr'), ('p', 'perr'))]
+    pairs.append(('logg', SC.logg, SC.logger, derived.loggMR, derived.loggMRerr))
+    report = []
+    for quantity, old, olderr, value, error in pairs:
+        sigma = np.sqrt(olderr.fillna(0)**2 + error.fillna(0)**2)
+        distance = (value - old).abs() / sigma.where(sigma > 0)
+        moved = (distance > 1) | ((sigma == 0) & (value.round(2) != old.round(2)))
+        moved &= value.notnull() & old.notnull()
+        report.append(pd.DataFrame({'name': SC.name[moved], 'quantity': quantity,
+                                    'old': old[moved], 'olderr': olderr[moved],
+                                    'new': value[moved], 'newerr': error[moved],
+                                    'sigma': distance[moved]}))
+    return pd.concat(report).sort_index(kind='mergesort')
+
+
+def _parse():
+    p = argparse.ArgumentParser(description='Derive the mass, radius, logg and parallax of all the stars again')
+    p.add_argument('input', help='The catalogue', nargs='?', default='WEBSITE_online.rdb')
+    p.add_argument('-o', '--output', help='The new catalogue', default='WEBSITE_recomputed.rdb')
+    p.add_argument('-d', '--diff', help='The values that changed beyond their errors',
+                   default='recompute_diff.csv')
+    p.add_argument('-w', '--workers', help='Number of processes', type=int, default=None)
+    p.add_argument('-m', '--method', help='Error propagation', default='mc',
+                   choices=['mc', 'adaptive', 'linear'])
+    p.add_argument('-s', '--seed', help='Seed of the random numbers', type=int, default=None)
+    p.add_argument('-g', '--grid', help='The extinction grid', default='extinction.npz')
+    return p.parse_args()
+
+
+def main():
+    args = _parse()
+    SC = readRDB(args.input)
+    derived = recompute(SC, args.workers, args.method, args.seed, args.grid)
+    new = update(SC, derived)
+    writeRDB(new, args.output)
+    report = diff(SC, new, derived)
+    report.to_csv(args.diff, index_label='row')
+    print('%d stars. Saved in %s' % (len(new), args.output))
+    for quantity, n in report.groupby('quantity', sort=False).size().items():
+        print('%s changed beyond the errors for %d stars' % (quantity, n))
+    print('See %s' % args.diff)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import pandas as pd
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _peakMemory():
+    """ Peak resident memory of the process in MB (None if unknown) """
+    if resource is None:
+        return None
+    # kB on Linux, bytes on macOS
+    scale = 1e6 if os.uname()[0] == 'Darwin' else 1e3
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+class RunLog:
+    """
+    Wall time, number of rows and memory of each stage of a run, e.g.
+
+        log = RunLog()
+        with log.stage('readSC') as record:
+            SC = readRDB()
+            record['rows'] = len(SC)
+        log.save('runlog.json')
+
+    Stages can be recorded from several threads.
+    """
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def add(self, stage, seconds, **fields):
+        """ Record a stage that took seconds """
+        record = dict(stage=stage, start=round(time.time() - seconds - self._start, 6),
+                      seconds=seconds, peak_memory=_peakMemory(), **fields)
+        with self._lock:
+            self.records.append(record)
+        return record
+
+    @contextlib.contextmanager
+    def stage(self, stage, **fields):
+        """
+        Time the block as a stage. The record (a dict) is given to the block,
+        which can add counters to it, e.g. the number of rows. If the block
+        fails, the exception is recorded in error.
+        """
+        record = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = repr(e)
+            raise
+        finally:
+            self.add(stage, time.perf_counter() - start, **record)
+
+    def timed(self, stage, func):
+        """ func recording each call as a stage """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def table(self):
+        """ The records as a DataFrame """
+        return pd.DataFrame(self.records)
+
+    def summary(self):
+        """ Number of calls and total and mean time of each stage """
+        df = self.table()
+        if df.empty:
+            return df
+        return df.groupby('stage', sort=False).seconds.agg(['count', 'sum', 'mean'])
+
+    def save(self, fname):
+        """ Save the records as JSON or as CSV (if fname ends with .csv) """
+        if fname.endswith('.csv'):
+            self.table().to_csv(fname, index=False)
+        else:
+            with open(fname, 'w') as f:
+                json.dump(self.records, f, indent=1, default=str)
+
+
+@contextlib.contextmanager
+def profile(fname=None):
+    """ Profile the block with cProfile and dump the stats to fname, if given """
+    if fname is None:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(fname)
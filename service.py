@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+# Keep SWEET-Cat and exoplanet.eu in memory, with their spatial and name
+# indexes, and answer queries over HTTP (or a Unix socket). The tables are
+# loaded again when their files change. Example:
+#
+#   python service.py --port 8042
+#   curl 'http://localhost:8042/cone?ra=330.79&dec=18.88&radius=60'
+#   curl 'http://localhost:8042/name?name=HD209458'
+#   curl 'http://localhost:8042/crossmatch?ra=330.79,10.5&dec=18.88,-20.2'
+#   curl 'http://localhost:8042/derived?name=HD209458'
+#
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import socketserver
+import threading
+import time
+import traceback
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import pandas as pd
+from catalogue import LINE, readRDB
+from crossmatch import SkyIndex
+from exotable import readTable
+from nameindex import NameIndex, normalize, strip_planet
+from recompute import INPUT, derive, extinction
+from sexagesimal import dec2deg, ra2deg
+
+
+def _mtime(fname):
+    """ Modification time of a file, None if it does not exist """
+    try:
+        return os.stat(fname).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _records(df):
+    """ The rows of a DataFrame as a list of dicts for JSON (NaN is null) """
+    return json.loads(df.to_json(orient='records'))
+
+
+def _degrees(values, parse, name):
+    """ Coordinates in degrees, or in sexagesimal strings (e.g. '12 20 43.02') """
+    values = list(np.atleast_1d(values))
+    try:
+        degrees = np.array(values, dtype=float)
+    except ValueError:
+        degrees = np.asarray(parse(values), dtype=float)
+    invalid = np.where(~np.isfinite(degrees))[0]
+    if invalid.size:
+        raise ValueError('Invalid %s: %s' % (name, ', '.join(str(values[i]) for i in invalid)))
+    return degrees
+
+
+def _positions(ra, dec, radius):
+    """ RA and DEC in degrees of the positions of a query, and its radius """
+    ra, dec = _degrees(ra, ra2deg, 'ra'), _degrees(dec, dec2deg, 'dec')
+    if len(ra) != len(dec):
+        raise ValueError('%d ra and %d dec values were given' % (len(ra), len(dec)))
+    if not radius >= 0:
+        raise ValueError('Invalid radius: %s' % radius)
+    return ra, dec
+
+
+class Tables:
+    """
+    The tables and their indexes, as loaded at a given time. They are never
+    modified, a reload builds a new Tables.
+
+    Parameters
+    ----------
+    sc : str
+        The SWEET-Cat catalogue, see catalogue.readRDB.
+    exo : list
+        The exoplanet.eu tables, e.g. exo.csv and exo_cont.csv. The
+        missing ones are left out.
+    method : str
+        Error propagation for the derived parameters, see
+        montecarlo.propagate.
+    grid : str
+        The extinction grid for the parallaxes, see extinction.py.
+    """
+    def __init__(self, sc='WEBSITE_online.rdb', exo=('exo.csv',), method='linear',
+                 grid='extinction.npz'):
+        # Before reading, so a change while reading is seen by the next check
+        self.mtimes = dict((fname, _mtime(fname)) for fname in [sc] + list(exo))
+        self.loaded = time.time()
+        self.SC = readRDB(sc)
+        tables = [readTable(fname) for fname in exo if os.path.isfile(fname)]
+        self.exo = pd.concat(tables, ignore_index=True) if tables else \
+            pd.DataFrame({'name': [], 'ra': [], 'dec': []})
+        self.sc_sky = SkyIndex(self.SC.radeg.values, self.SC.decdeg.values)
+        self.exo_sky = SkyIndex(self.exo.ra.values, self.exo.dec.values)
+        self.sc_index = NameIndex.from_catalogue(self.SC)
+        self.planet_index = NameIndex(self.exo.name)
+        # The rows of the planets of each host, and the host in SWEET-Cat of
+        # each planet (by name, or else by position)
+        hosts = normalize(strip_planet(self.exo.name)).values
+        self.planets = pd.Series(np.arange(len(hosts))).groupby(hosts).indices
+        self.hosts = np.array([self.sc_index.index.get(host, -1) for host in hosts], dtype=int)
+        nearest, _ = self.sc_sky.nearest(self.exo.ra.values, self.exo.dec.values)
+        self.hosts = np.where(self.hosts >= 0, self.hosts, nearest)
+        stars = self.SC.loc[:, [column for column in INPUT if column in self.SC]]
+        stars['Av'], stars['Averr'] = extinction(self.SC, grid)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.derived = derive(stars, method)
+        # The rows ready for the answers
+        self.sc_rows = _records(self.SC.drop(columns=LINE))
+        self.exo_rows = _records(self.exo)
+        self.derived_rows = _records(self.derived)
+
+
+    def changed(self):
+        """ True if any of the files changed since they were loaded """
+        return any(_mtime(fname) != mtime for fname, mtime in self.mtimes.items())
+
+
+    def resolve(self, name):
+        """
+        Row in SWEET-Cat of a star name (or alias) or of the host of a
+        planet name (by name, or else by position). -1 if not found.
+        """
+        row = self.sc_index.get(name)
+        if row != -1:
+            return row
+        planet = self.planet_index.get(name)
+        if planet != -1:
+            return int(self.hosts[planet])
+        return self.sc_index.get(strip_planet([name])[0])
+
+
+class Catalogue:
+    """
+    The queries answered by the service, on the tables loaded last. The
+    tables are loaded again (in the background with watch, or with reload)
+    when their files change, and swapped in once ready, so queries never
+    wait for a reload.
+    """
+    def __init__(self, sc='WEBSITE_online.rdb', exo=('exo.csv',), method='linear',
+                 grid='extinction.npz'):
+        self.options = dict(sc=sc, exo=list(exo), method=method, grid=grid)
+        self.tables = Tables(**self.options)
+        self.reloads = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+
+    def reload(self, force=False):
+        """ Load the tables again if their files changed. True if reloaded """
+        with self._lock:
+            if not (force or self.tables.changed()):
+                return False
+            try:
+                tables = Tables(**self.options)
+            except Exception as e:
+                # A file in the middle of being written, try again later
+                self.error = repr(e)
+                return False
+            self.tables = tables
+            self.reloads += 1
+            self.error = None
+            return True
+
+
+    def watch(self, interval=2.):
+        """ Check the files every interval seconds in a background thread """
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.reload()
+        thread = threading.Thread(target=loop, name='reload', daemon=True)
+        thread.start()
+        return thread
+
+
+    def status(self):
+        t = self.tables
+        return {'sc': len(t.SC), 'exo': len(t.exo), 'loaded': t.loaded,
+                'reloads': self.reloads, 'error': self.error,
+                'files': dict((fname, mtime is not None) for fname, mtime in t.mtimes.items())}
+
+
+    def cone(self, ra, dec, radius=60., table='sc'):
+        """
+        The stars (table sc) or planets (table exo) within radius arcsec of a
+        position, closest first, with the separation (sep) in arcsec
+        """
+        t = self.tables
+        if table not in ('sc', 'exo'):
+            raise ValueError('Unknown table %s, use sc or exo' % table)
+        sky, records = (t.sc_sky, t.sc_rows) if table == 'sc' else (t.exo_sky, t.exo_rows)
+        ra, dec = _positions(ra, dec, radius)
+        rows, sep = sky.cone(ra[0], dec[0], radius)
+        return {'count': len(rows),
+                'rows': [dict(records[row], sep=float(s)) for row, s in zip(rows, sep)]}
+
+
+    def name(self, name):
+        """ The SWEET-Cat star of a star or planet name, and its planets """
+        t = self.tables
+        row = t.resolve(name)
+        if row == -1:
+            return {'name': name, 'star': None, 'planets': []}
+        # The planets with the name of the star, or at its position
+        planets = set(t.exo_sky.cone(t.SC.radeg.values[row], t.SC.decdeg.values[row], 5.)[0])
+        for key in t.sc_index.aliases(row):
+            planets.update(t.planets.get(key, []))
+        return {'name': name, 'star': t.sc_rows[row],
+                'planets': [t.exo_rows[planet] for planet in sorted(planets)]}
+
+
+    def crossmatch(self, ra, dec, radius=5.):
+        """ The closest SWEET-Cat star within radius arcsec of each position """
+        t = self.tables
+        match, sep = t.sc_sky.nearest(*_positions(ra, dec, radius), radius=radius)
+        found = match >= 0
+        names = np.where(found, t.SC.name.values[np.maximum(match, 0)], None)
+        return {'matches': [{'row': int(m) if f else None, 'name': n,
+                             'sep': float(s) if f else None}
+                            for m, n, s, f in zip(match, names, sep, found)]}
+
+
+    def derived(self, name):
+        """
+        The mass, radius, logg and spectroscopic parallax derived for a star
+        (see recompute.derive), next to the values in SWEET-Cat
+        """
+        t = self.tables
+        row = t.resolve(name)
+        if row == -1:
+            return {'name': name, 'star': None, 'derived': None}
+        star = t.sc_rows[row]
+        return {'name': name,
+                'star': dict((key, star.get(key)) for key in ('name', 'M', 'Merr', 'logg',
+                                                               'logger', 'p', 'perr')),
+                'derived': t.derived_rows[row]}
+
+
+def _split(params, key):
+    """ A list of values given as key=1,2,3 or key=1&key=2 """
+    return [v for value in params.get(key, []) for v in value.split(',') if v.strip()]
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ JSON over HTTP, the catalogue is server.catalogue """
+    # Keep the connections open between the queries of a client
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # The headers and the body are sent in two writes, which Nagle's
+        # algorithm delays on TCP connections
+        self.disable_nagle_algorithm = not isinstance(self.server, UnixHTTPServer)
+        BaseHTTPRequestHandler.setup(self)
+
+    def _params(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = json.loads(self.rfile.read(length).decode('utf8'))
+            params.update((k, [','.join(map(str, v))] if isinstance(v, list) else [str(v)])
+                          for k, v in body.items())
+        return url.path.rstrip('/'), params
+
+
+    def _query(self, path, params):
+        catalogue = self.server.catalogue
+        def one(key, default=None):
+            value = params.get(key, [default])[0]
+            if value is None:
+                raise ValueError('%s is missing' % key)
+            return value
+        if path == '/cone':
+            return catalogue.cone(one('ra'), one('dec'), float(one('radius', 60.)),
+                                  one('table', 'sc'))
+        if path == '/name':
+            return catalogue.name(one('name'))
+        if path == '/crossmatch':
+            return catalogue.crossmatch(_split(params, 'ra'), _split(params, 'dec'),
+                                        float(one('radius', 5.)))
+        if path == '/derived':
+            return catalogue.derived(one('name'))
+        if path in ('', '/status'):
+            return catalogue.status()
+        return None
+
+
+    def _answer(self):
+        try:
+            path, params = self._params()
+            result = self._query(path, params)
+            code = 200 if result is not None else 404
+            if result is None:
+                result = {'error': 'Unknown query %s' % path}
+            body = json.dumps(result).encode('utf8')
+        except (ValueError, KeyError) as e:
+            code, body = 400, json.dumps({'error': str(e)}).encode('utf8')
+        except Exception as e:
+            # Any other failure is answered too, so the client never hangs
+            self.log_error('%s', traceback.format_exc())
+            code, body = 500, json.dumps({'error': '%s: %s' % (type(e).__name__, e)}).encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _answer
+
+
+    def address_string(self):
+        # The client address of a Unix socket is not a host
+        return str(self.client_address[0] if self.client_address else 'unix')
+
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def server(catalogue, host='127.0.0.1', port=8042, socket=None, verbose=False):
+    """ The HTTP server for a Catalogue, on a TCP port or on a Unix socket """
+    if socket is not None:
+        if os.path.exists(socket):
+            os.remove(socket)
+        httpd = UnixHTTPServer(socket, Handler)
+    else:
+        httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.catalogue = catalogue
+    httpd.verbose = verbose
+    return httpd
+
+
+def _parse():
+    p = argparse.ArgumentParser(description='Serve SWEET-Cat and exoplanet.eu queries from memory')
+    p.add_argument('--sc', help='The catalogue', default='WEBSITE_online.rdb')
+    p.add_argument('--exo', help='The exoplanet.eu tables', nargs='+', default=['exo.csv'])
+    p.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    p.add_argument('-p', '--port', help='Port to listen on', type=int, default=8042)
+    p.add_argument('-s', '--socket', help='Listen on this Unix socket instead', default=None)
+    p.add_argument('-i', '--interval', help='Seconds between the checks of the files',
+                   type=float, default=2.)
+    p.add_argument('-m', '--method', help='Error propagation of the derived parameters',
+                   default='linear', choices=['mc', 'adaptive', 'linear'])
+    p.add_argument('-g', '--grid', help='The extinction grid', default='extinction.npz')
+    p.add_argument('-v', '--verbose', help='Log each request', default=False,
+                   action='store_true')
+    return p.parse_args()
+
+
+def main():
+    args = _parse()
+    catalogue = Catalogue(args.sc, args.exo, args.method, args.grid)
+    catalogue.watch(args.interval)
+    httpd = server(catalogue, args.host, args.port, args.socket, args.verbose)
+    print('%d stars and %d planets. Serving on %s' % (len(catalogue.tables.SC),
+          len(catalogue.tables.exo), args.socket or 'http://%s:%d' % (args.host, args.port)))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
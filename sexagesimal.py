@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import numpy as np
+import pandas as pd
+
+
+def _parse(values, scale):
+    """ Sexagesimal strings (separated by spaces or colons) to degrees """
+    s = pd.Series(np.atleast_1d(values)).astype(str).str.strip().str.replace(':', ' ')
+    parts = s.str.split(n=2, expand=True).reindex(columns=range(3))
+    d, m, sec = [pd.to_numeric(parts[i], errors='coerce').values for i in range(3)]
+    sign = np.where(s.str.startswith('-').values, -1., 1.)
+    return sign * (np.abs(d) + np.nan_to_num(m)/60. + np.nan_to_num(sec)/3600.) * scale
+
+
+def ra2deg(ra):
+    """
+    RA in hours, e.g. '12 20 43.02' or '12:20:43.02', to degrees. Invalid
+    values (e.g. NULL) are NaN.
+    """
+    return _parse(ra, 15.)
+
+
+def dec2deg(dec):
+    """
+    DEC in degrees, e.g. '+17 47 34.33' or '-00 30 00.0', to degrees.
+    Invalid values (e.g. NULL) are NaN.
+    """
+    return _parse(dec, 1.)
+
+
+def _split(x, decimals):
+    """ Integer units, minutes and seconds of positive values, rounded to decimals """
+    seconds = np.round(np.nan_to_num(x)*3600., decimals)
+    units, seconds = np.divmod(seconds, 3600.)
+    minutes, seconds = np.divmod(seconds, 60.)
+    return units.astype(int), minutes.astype(int), seconds
+
+
+def _format(sign, units, minutes, seconds, decimals, valid):
+    width = decimals + 3 if decimals else 2
+    units = pd.Series(units).astype(str).str.zfill(2)
+    minutes = pd.Series(minutes).astype(str).str.zfill(2)
+    seconds = pd.Series(seconds).map(('%.' + str(decimals) + 'f').__mod__).astype(str).str.zfill(width)
+    values = (sign + units + ' ' + minutes + ' ' + seconds).values.astype(str)
+    return np.where(valid, values, 'NULL')
+
+
+def deg2ra(ra, decimals=2):
+    """ RA in degrees to the SWEET-Cat format, e.g. '12 20 43.02' (NaN is NULL) """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float)) % 360.
+    h, m, s = _split(ra/15., decimals)
+    return _format('', h % 24, m, s, decimals, np.isfinite(ra))
+
+
+def deg2dec(dec, decimals=2):
+    """ DEC in degrees to the SWEET-Cat format, e.g. '+17 47 34.33' or '-05 00 00.00' """
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    d, m, s = _split(np.abs(dec), decimals)
+    sign = pd.Series(np.where(dec < 0, '-', '+'))
+    return _format(sign, d, m, s, decimals, np.isfinite(dec))
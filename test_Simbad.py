@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+import threading
+import numpy as np
+from astropy.io.votable import parse_single_table
+import pytest
+import Simbad
+
+
+# A recorded answer of the Simbad TAP service: two identifiers of 14 Her
+# were found, with the name as given first (rank 0)
+RESPONSE = b'''name,rank,main_id,ra,dec,V,Verr,p,perr,sptype,ids
+14 Her,0,HD 145675,242.6012891,43.8176456,6.67,0.01,55.8,0.02,K0V,HD 145675|14 Her|HIP 79248
+BD-10 3166,1,BD-10 3166,160.0000000,-10.7744444,10.0,,11.5,0.5,K3.0V,BD-10 3166|LTT 3985
+'''
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.headers['Content-Type'], body))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server):
+    return 'http://127.0.0.1:%d/sync' % server.server_port
+
+
+def test_upload(server):
+    Simbad.query(['14 Her', 'BD-10 3166'], url=_url(server))
+    content_type, body = server.requests[0]
+    message = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode() +
+                                       b'\r\n\r\n' + body)
+    parts = dict((part.get_param('name', header='content-disposition'), part)
+                 for part in message.get_payload())
+    assert parts['REQUEST'].get_payload() == 'doQuery'
+    assert parts['LANG'].get_payload() == 'ADQL'
+    assert parts['UPLOAD'].get_payload() == 'targets,param:targets'
+    assert 'FROM TAP_UPLOAD.targets' in parts['QUERY'].get_payload()
+    upload = parse_single_table(BytesIO(parts['targets'].get_payload(decode=True))).to_table()
+    assert list(upload['name']) == ['14 Her', 'BD-10 3166', 'BD-10 3166']
+    assert list(upload['id']) == ['14 Her', 'BD-10 3166', 'BD 10 3166']
+    assert list(upload['rank']) == [0, 0, 1]
+
+
+def test_known_and_unknown_names(server):
+    result = Simbad.query(['14 Her', 'Nothing 1', 'BD-10 3166'], url=_url(server))
+    assert list(result.index) == ['14 Her', 'Nothing 1', 'BD-10 3166']
+    star = result.loc['14 Her']
+    assert star.main_id == 'HD 145675'
+    assert star.ra == '16 10 24.31'
+    assert star.dec == '+43 49 03.52'
+    assert star.V == 6.67 and star.p == 55.8
+    assert star.ids.split('|')[:2] == ['HD 145675', '14 Her']
+    assert result.loc['BD-10 3166'].main_id == 'BD-10 3166'
+    assert np.isnan(result.loc['BD-10 3166'].Verr)
+    missing = result.loc['Nothing 1']
+    assert missing.isnull()[['main_id', 'radeg', 'decdeg', 'V', 'p', 'ids']].all()
+    assert missing.ra == 'NULL' and missing.dec == 'NULL'
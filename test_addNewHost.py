@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+from astropy.table import Table
+import numpy as np
+import pandas as pd
+import pytest
+import addNewHost
+from catalogue import readRDB
+from querycache import QueryCache
+
+
+RA, DEC = '10 00 00.00', '+20 00 00.00'
+
+
+def offline(ra, de, radius='10s'):
+    raise ConnectionError('offline')
+
+
+def online(ra, de, radius='10s'):
+    return pd.DataFrame({'plx': [12.3456], 'e_plx': [0.0512], 'sep': [0.1],
+                         'source': [1]})
+
+
+def test_failed_gaia_lookup_is_retried(tmp_path, monkeypatch):
+    fname = str(tmp_path / 'querycache.sqlite')
+    query = addNewHost.gaiaQuery
+    cache = QueryCache(fname)
+    monkeypatch.setattr(addNewHost, 'GAIAplxBatch', offline)
+    monkeypatch.setattr(addNewHost, 'gaiaQuery', cache.cached('gaia', query, radius='10s'))
+    assert addNewHost.GAIAplx(RA, DEC) == ('NULL', 'NULL')
+    assert cache.get('gaia', RA, DEC, '10s') == (False, None)
+    cache.close()
+    # The next run queries Gaia again
+    cache = QueryCache(fname)
+    monkeypatch.setattr(addNewHost, 'GAIAplxBatch', online)
+    monkeypatch.setattr(addNewHost, 'gaiaQuery', cache.cached('gaia', query, radius='10s'))
+    assert addNewHost.GAIAplx(RA, DEC) == ('12.35', '0.05')
+    assert cache.get('gaia', RA, DEC, '10s') == (True, ('12.35', '0.05'))
+    cache.close()
+
+
+def _exo():
+    return pd.DataFrame({'star_name': ['Star A', 'Star B'], 'ra': [150., 30.],
+                         'dec': [20., -5.], 'mag_v': [7.1, 9.5],
+                         'star_metallicity': [0.1, np.nan],
+                         'star_metallicity_error_min': [0.05, np.nan],
+                         'star_metallicity_error_max': [0.07, np.nan],
+                         'star_teff': [5800., 5000.],
+                         'star_teff_error_min': [50., np.nan],
+                         'star_teff_error_max': [70., np.nan]})
+
+
+def simbad(ra, dec):
+    if ra != 150.:
+        raise ConnectionError('offline')
+    return Table({'MAIN_ID': ['Star A b', 'Star A'],
+                  'RA': ['10 00 00.0000', '10 00 00.0000'],
+                  'DEC': ['+20 00 00.000', '+20 00 00.000'],
+                  'OTYPE': ['Planet', '*'], 'IDS': ['Star A b', 'HD 1|Star A'],
+                  'FLUX_V': [7.123, 7.123], 'FLUX_ERROR_V': [0.011, 0.011],
+                  'PLX_VALUE': [10., 10.], 'PLX_ERROR': [0.5, 0.5],
+                  'SP_TYPE': ['', 'G2V']})
+
+
+def gaia(ra, dec):
+    return ('12.35', '0.05') if ra == '10 00 00.00' else ('NULL', 'NULL')
+
+
+def dust(ra, dec):
+    return 0.1, 0.01
+
+
+SERVICES = {'simbad': simbad, 'gaia': gaia, 'dust': dust}
+RATES = {'simbad': None, 'gaia': None, 'dust': None}
+
+
+def test_batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    missing = addNewHost.batch(['Star A\n', 'Star B\n', 'Nothing\n'], _exo(), 'new.rdb',
+                               workers=2, services=SERVICES, rates=RATES)
+    rows = readRDB('new.rdb', sidecar=False).set_index('name')
+    a, b = rows.loc['Star A'], rows.loc['Star B']
+    # Simbad, then Gaia
+    assert a.hd == '1' and a.ra == '10 00 00.00' and a.V == 7.12 and a.Verr == 0.01
+    assert (a.p, a.perr, a.pflag) == (12.35, 0.05, 'GAIADR2')
+    assert (a.Teff, a.Tefferr, a.feh, a.feherr) == (5800, 60, 0.1, 0.06)
+    # Simbad failed and Gaia found nothing: the position and V of
+    # exoplanet.eu, and the extinction for the review
+    assert b.ra == '02 00 00.00' and b.dec == '-05 00 00.00' and b.V == 9.5
+    assert np.isnan(b.p) and np.isnan(b.Tefferr)
+    missing = missing.set_index('star')
+    assert missing.loc['Star A', 'missing'] == 'logg logger vt vterr M Merr author link'
+    assert set(missing.loc['Star B', 'missing'].split()) >= {'hd', 'p', 'perr', 'feh', 'feherr'}
+    assert (missing.loc['Star B', 'Av'], missing.loc['Star B', 'Averr']) == (0.1, 0.01)
+    with open('manual.list') as f:
+        assert f.read() == 'Nothing\n'
+
+
+def test_batch_raises_bugs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    def broken(ra, dec):
+        return None + 1
+    with pytest.raises(TypeError):
+        addNewHost.batch(['Star A\n'], _exo(), 'new.rdb', workers=1,
+                         services=dict(SERVICES, gaia=broken), rates=RATES)
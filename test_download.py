@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import gzip
+from http.client import IncompleteRead
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.error import HTTPError
+import os
+import threading
+import pytest
+from download import download
+
+
+BODY = b'name,ra,dec\n' + b'Star b,10.0,20.0\n'*1000
+ETAG = '"v1"'
+MODIFIED = 'Mon, 30 Jul 2018 10:00:00 GMT'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.server.fail:
+            self.send_error(503)
+            return
+        # If-None-Match takes precedence over If-Modified-Since
+        etag = self.headers.get('If-None-Match')
+        if etag == self.server.etag if etag else \
+           self.headers.get('If-Modified-Since') == MODIFIED:
+            self.send_response(304)
+            self.end_headers()
+            return
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = gzip.compress(BODY) if gzipped else BODY
+        self.send_response(200)
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Last-Modified', MODIFIED)
+        self.end_headers()
+        # A connection lost in the middle of the body
+        self.wfile.write(body[:len(body)//2] if self.server.truncate else body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    httpd.requests = []
+    httpd.etag = ETAG
+    httpd.fail = False
+    httpd.truncate = False
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server):
+    return 'http://127.0.0.1:%d/exo.csv' % server.server_port
+
+
+def test_first_fetch(server, tmp_path):
+    fname = str(tmp_path / 'exo.csv')
+    assert download(_url(server), fname)
+    with open(fname, 'rb') as f:
+        assert f.read() == BODY
+    assert 'If-None-Match' not in server.requests[0]
+    assert os.path.isfile(fname + '.json')
+
+
+def test_gzip_body(server, tmp_path):
+    fname = str(tmp_path / 'exo.csv')
+    download(_url(server), fname, chunksize=100)
+    assert server.requests[0]['Accept-Encoding'] == 'gzip'
+    with open(fname, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_not_modified(server, tmp_path):
+    fname = str(tmp_path / 'exo.csv')
+    download(_url(server), fname)
+    mtime = os.stat(fname).st_mtime_ns
+    assert not download(_url(server), fname)
+    assert server.requests[1]['If-None-Match'] == ETAG
+    assert server.requests[1]['If-Modified-Since'] == MODIFIED
+    assert os.stat(fname).st_mtime_ns == mtime
+
+
+def test_failed_fetch_keeps_file(server, tmp_path):
+    fname = str(tmp_path / 'exo.csv')
+    download(_url(server), fname)
+    server.fail = True
+    with pytest.raises(HTTPError):
+        download(_url(server), fname)
+    with open(fname, 'rb') as f:
+        assert f.read() == BODY
+    assert not os.path.isfile(fname + '.part')
+
+
+def test_interrupted_fetch_keeps_file(server, tmp_path):
+    fname = str(tmp_path / 'exo.csv')
+    download(_url(server), fname)
+    server.etag, server.truncate = '"v2"', True
+    with pytest.raises(IncompleteRead):
+        download(_url(server), fname, chunksize=100)
+    with open(fname, 'rb') as f:
+        assert f.read() == BODY
+    assert not os.path.isfile(fname + '.part')
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import numpy as np
+from TorresMass import massTorresBatch, radTorresBatch
+
+
+# A star with tight and one with loose spectroscopic parameters
+TEFF, ERTEFF = [5777., 5777.], [10., 300.]
+LOGG, ERLOGG = [4.44, 4.44], [0.01, 0.3]
+FEH, ERFEH = [0., 0.], [0.01, 0.2]
+
+
+def test_adaptive_tight_star_stops_earlier():
+    for batch in (massTorresBatch, radTorresBatch):
+        _, _, n = batch(TEFF, ERTEFF, LOGG, ERLOGG, FEH, ERFEH, method='adaptive',
+                        seed=1, full_output=True)
+        assert n[0] < n[1]
+
+
+def test_adaptive_fewer_trials_than_mc():
+    for batch in (massTorresBatch, radTorresBatch):
+        _, _, n = batch(TEFF, ERTEFF, LOGG, ERLOGG, FEH, ERFEH, method='adaptive',
+                        seed=1, full_output=True)
+        _, _, nmc = batch(TEFF, ERTEFF, LOGG, ERLOGG, FEH, ERFEH, method='mc',
+                          seed=1, full_output=True)
+        assert n.sum() < nmc.sum()
+
+
+def test_adaptive_agrees_with_mc():
+    for batch in (massTorresBatch, radTorresBatch):
+        mean, sigma = batch(TEFF, ERTEFF, LOGG, ERLOGG, FEH, ERFEH, method='adaptive', seed=1)
+        meanmc, sigmamc = batch(TEFF, ERTEFF, LOGG, ERLOGG, FEH, ERFEH, method='mc', seed=1)
+        np.testing.assert_allclose(mean, meanmc, rtol=0.02)
+        np.testing.assert_allclose(sigma, sigmamc, rtol=0.05)
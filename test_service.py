@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import numpy as np
+import pytest
+from service import _positions
+
+
+def test_positions():
+    ra, dec = _positions(['16 10 24.31'], ['+43 49 03.52'], 5.)
+    np.testing.assert_allclose([ra[0], dec[0]], [242.60129, 43.81764], atol=1e-5)
+    ra, dec = _positions(['242.6', '10.5'], ['43.8', '-20.2'], 5.)
+    np.testing.assert_allclose(ra, [242.6, 10.5])
+    np.testing.assert_allclose(dec, [43.8, -20.2])
+
+
+@pytest.mark.parametrize('ra, dec, radius, message', [
+    ('abc', '1', 60., 'Invalid ra: abc'),
+    ('1', 'nan', 60., 'Invalid dec: nan'),
+    (['1', '2'], ['3'], 5., '2 ra and 1 dec values were given'),
+    ('1', '2', np.nan, 'Invalid radius: nan'),
+])
+def test_invalid_positions(ra, dec, radius, message):
+    with pytest.raises(ValueError, match=message):
+        _positions(ra, dec, radius)